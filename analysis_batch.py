@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+# OpenAI bills Batch API tokens at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_POLL_SECONDS = 30
+# Batch statuses after which nothing more will happen
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+LOCAL_BATCH_DIR = os.path.join("batch_jobs", "local_backend")
+
+JOB_FILE = "job.json"
+REQUESTS_FILE = "requests.jsonl"
+OUTPUT_FILE = "output.jsonl"
+
+
+# One line of a batch request file: a chat completion body tagged with an id
+# that comes back unchanged in the output file
+def chat_request(custom_id, body):
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+# Output lines by custom_id as {"content", "usage", "error"}. Handles both
+# successful lines and the error file's lines.
+def read_batch_output(path):
+    outputs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+                outputs[item["custom_id"]] = {"content": None, "usage": None,
+                                              "error": error.get("message", str(error)) if isinstance(error, dict) else str(error)}
+            else:
+                outputs[item["custom_id"]] = {"content": body["choices"][0]["message"]["content"],
+                                              "usage": body.get("usage"), "error": None}
+    return outputs
+
+
+# The OpenAI Batch API: the request file is uploaded and answered within the
+# completion window at a discount
+class OpenAIBatchBackend:
+    name = "openai"
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, request_path):
+        with open(request_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {"status": batch.status, "completed": counts.completed if counts else 0,
+                "failed": counts.failed if counts else 0, "total": counts.total if counts else 0}
+
+    # Write the output and error files of a finished batch to output_path
+    def download(self, batch_id, output_path):
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, "w", encoding="utf-8") as out:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    text = self.client.files.content(file_id).text
+                    out.write(text if text.endswith("\n") or not text else text + "\n")
+
+
+def stub_respond(body):
+    from openai_stub import stub_answer
+    return stub_answer(body["messages"])
+
+
+# Stand-in for the Batch API that keeps everything in local files. The batch
+# is answered on its first status poll by respond(body) -> content, which by
+# default gives the canned reply of openai_stub.py.
+class LocalBatchBackend:
+    name = "local"
+
+    def __init__(self, directory=LOCAL_BATCH_DIR, respond=None):
+        self.directory = directory
+        self.respond = respond
+
+    def _path(self, batch_id, name):
+        return os.path.join(self.directory, batch_id, name)
+
+    def submit(self, request_path):
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(request_path, self._path(batch_id, REQUESTS_FILE))
+        return batch_id
+
+    def _run(self, batch_id):
+        respond = self.respond or stub_respond
+        with open(self._path(batch_id, REQUESTS_FILE), "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        partial = self._path(batch_id, OUTPUT_FILE + ".tmp")
+        with open(partial, "w", encoding="utf-8") as out:
+            for request in requests:
+                try:
+                    content = respond(request["body"])
+                    item = {"custom_id": request["custom_id"], "error": None, "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                                 "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}},
+                    }}
+                except Exception as e:
+                    item = {"custom_id": request["custom_id"], "response": None,
+                            "error": {"code": type(e).__name__, "message": str(e)}}
+                out.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(partial, self._path(batch_id, OUTPUT_FILE))
+        return len(requests)
+
+    def status(self, batch_id):
+        if not os.path.exists(self._path(batch_id, OUTPUT_FILE)):
+            self._run(batch_id)
+        outputs = read_batch_output(self._path(batch_id, OUTPUT_FILE))
+        failed = sum(output["error"] is not None for output in outputs.values())
+        return {"status": "completed", "completed": len(outputs) - failed, "failed": failed, "total": len(outputs)}
+
+    def download(self, batch_id, output_path):
+        shutil.copyfile(self._path(batch_id, OUTPUT_FILE), output_path)
+
+
+def make_backend(name, client=None):
+    if name == "openai":
+        return OpenAIBatchBackend(client)
+    if name == "local":
+        return LocalBatchBackend()
+    raise ValueError(f"Unknown batch backend {name!r}; use 'openai' or 'local'")
+
+
+# Write requests to a new job directory under base_dir, submit them and save
+# the job description (backend, batch id and any extra fields) next to them.
+# A job with no requests is recorded without submitting anything.
+def create_job(base_dir, backend, requests, **fields):
+    job_dir = os.path.join(base_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+    os.makedirs(job_dir)
+    request_path = os.path.join(job_dir, REQUESTS_FILE)
+    with open(request_path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    job = {"backend": backend.name, "batch_id": backend.submit(request_path) if requests else None,
+           "requests": len(requests), "submitted_at": time.strftime("%Y-%m-%d %H:%M:%S"), **fields}
+    save_job(job_dir, job)
+    return job_dir
+
+
+def load_job(job_dir):
+    with open(os.path.join(job_dir, JOB_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_job(job_dir, job):
+    with open(os.path.join(job_dir, JOB_FILE), "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+
+
+# Job directories under base_dir, newest first
+def list_jobs(base_dir):
+    if not os.path.isdir(base_dir):
+        return []
+    job_dirs = [os.path.join(base_dir, name) for name in os.listdir(base_dir)
+                if os.path.exists(os.path.join(base_dir, name, JOB_FILE))]
+    return sorted(job_dirs, key=lambda job_dir: os.path.getmtime(os.path.join(job_dir, JOB_FILE)), reverse=True)
+
+
+def job_status(backend, job):
+    if job["batch_id"] is None:
+        return {"status": "completed", "completed": 0, "failed": 0, "total": 0}
+    return backend.status(job["batch_id"])
+
+
+def wait_for_job(backend, job, poll_seconds=BATCH_POLL_SECONDS, on_status=None):
+    while True:
+        status = job_status(backend, job)
+        if on_status:
+            on_status(status)
+        if status["status"] in FINISHED_STATUSES:
+            return status
+        time.sleep(poll_seconds)
+
+
+# Download a finished job's output into its directory and return it by custom_id
+def fetch_job_output(backend, job_dir, job):
+    if job["batch_id"] is None:
+        return {}
+    output_path = os.path.join(job_dir, OUTPUT_FILE)
+    if not os.path.exists(output_path):
+        backend.download(job["batch_id"], output_path)
+    return read_batch_output(output_path)
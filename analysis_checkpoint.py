@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from instrumentation import open_jsonl_for_append
+
+
+# Identifies one analysis: the company plus a hash of everything that would
+# change its answer, e.g. the description, prompt version and model
+def checkpoint_key(company, *parts):
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:16]
+    return f"{company}:{digest}"
+
+
+# Append-only JSON Lines file of finished analyses. Each record is written and
+# flushed as soon as it arrives, so an interrupted run loses at most the calls
+# still in flight; on load the last record for a key wins.
+class AnalysisCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by a crash
+                    self.records[record["key"]] = record
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def save(self, key, **fields):
+        record = {"key": key, "ts": time.time(), **fields}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open_jsonl_for_append(self.path) as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[key] = record
+        return record
@@ -1,15 +1,23 @@
 import streamlit as st
-import PyPDF2
-import sqlite3
+import logging
 import os
-from datetime import datetime
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
+import time
 import pandas as pd
-import io
+import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
+from database import Database
+from knowledge_base import KnowledgeBase, DB_PATH, load_initial_context
+from encoders import load_encoder
+from ingestion_jobs import IngestionQueue
+import rag_pipeline
+import instrumentation
+from tech_disruptor import StartupIndex, StartupRanker, load_startup_data, read_startup_excel, to_excel_bytes
+
+# Per-query context and token counts from rag_pipeline are logged at INFO
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+instrumentation.set_app("cj_agent")
 
 # Load environment variables
 load_dotenv()
@@ -18,146 +26,123 @@ if not openai_api_key:
     st.error("Open AI API key not found. Please set the OPENAI_API_KEY in the .env file.")
     st.stop()
 
-client = OpenAI(api_key=openai_api_key)
+# Files listed per page of the View Context page
+FILES_PER_PAGE = 20
 
 # Set page configuration
 st.set_page_config(page_title="CJ Express AI Agent", page_icon="static/cj_express_logo.png")
 
+# Heavy resources are created once per process and shared by every rerun and
+# user session. Streamlit re-executes this script on each interaction, so they
+# must never be constructed at module level.
+@st.cache_resource
+def get_openai_client(api_key):
+    return OpenAI(api_key=api_key)
+
+# (encoder, embedding cache id) for the backend chosen by EMBEDDING_BACKEND
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_encoder():
+    return load_encoder()
+
+# One SQLite handle for the process; knowledge base reloads and the ingestion
+# queue all share it
+@st.cache_resource
+def get_database():
+    # Ensure data directory exists
+    if not os.path.exists('data'):
+        os.makedirs('data')
+    return Database(DB_PATH)
+
+@st.cache_resource(show_spinner="Loading knowledge base...")
+def get_knowledge_base():
+    encoder, model_id = get_encoder()
+    kb = KnowledgeBase(encoder, get_database(), model_name=model_id)
+    if not load_initial_context(kb):
+        st.warning("Initial context file (data/initial_context.txt) not found. Please ensure it exists.")
+    return kb
+
+# Background worker pool for uploads, shared by every session
+@st.cache_resource
+def get_ingestion_queue():
+    return IngestionQueue(get_knowledge_base())
+
+# Answers to repeated questions, shared by every session and invalidated
+# whenever the corpus version changes
+@st.cache_resource
+def get_answer_cache():
+    return rag_pipeline.AnswerCache()
+
+# Row embeddings for the Tech Disruptor spreadsheet, built once per file
+# version (path and modification time, or upload id) and shared by sessions
+@st.cache_resource(show_spinner="Indexing startup data...", max_entries=4)
+def get_startup_index(data_key, _df):
+    return StartupIndex(_df, get_knowledge_base().encode)
+
+# cmu_startups.xlsx is parsed (or read from its Parquet cache) once per file
+# version and the single read-only DataFrame is shared by every session
+@st.cache_resource(show_spinner="Loading startup data...", max_entries=2)
+def get_startup_data(file_path, mtime):
+    return load_startup_data(file_path)
+
+# Excel export bytes, built on first request and reused until the data changes
+@st.cache_resource(max_entries=4)
+def get_excel_export(data_key, _df):
+    return to_excel_bytes(_df)
+
+# Precomputed per-pillar orderings for ranking and filter questions
+@st.cache_resource(max_entries=4)
+def get_startup_ranker(data_key, _df):
+    return StartupRanker(_df)
+
+# Drop the shared knowledge base so the next call reloads it from disk. The
+# ingestion queue is kept, so jobs it owns are not mistaken for orphans, and
+# ingests later uploads into the reloaded knowledge base.
+def invalidate_knowledge_base():
+    get_knowledge_base.clear()
+    get_ingestion_queue().set_knowledge_base(get_knowledge_base())
+
+client = get_openai_client(openai_api_key)
+
 # Initialize components for RAG (used only for context pages)
 try:
-    model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+    get_encoder()
 except Exception as e:
-    st.error(f"Failed to load SentenceTransformer model: {e}")
+    st.error(f"Failed to load embedding model: {e}")
     st.stop()
 
-dimension = 768  # Dimension of paraphrase-multilingual-mpnet-base-v2 embeddings
-index = faiss.IndexFlatL2(dimension)
-
-# Initialize SQLite database
 try:
-    conn = sqlite3.connect('context.db')
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS files 
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, upload_date TEXT, content TEXT)''')
-    conn.commit()
+    kb = get_knowledge_base()
+    # Another process (e.g. a second server) rewrote the index since it was cached
+    if kb.is_stale():
+        invalidate_knowledge_base()
+        kb = get_knowledge_base()
+    ingestion_queue = get_ingestion_queue()
 except Exception as e:
-    st.error(f"Failed to initialize SQLite database: {e}")
+    st.error(f"Failed to initialize knowledge base: {e}")
     st.stop()
 
-# Ensure data directory exists
-if not os.path.exists('data'):
-    os.makedirs('data')
-
-# Load initial context if not already in database
-initial_context_path = 'data/initial_context.txt'
-if os.path.exists(initial_context_path):
-    cursor.execute("SELECT COUNT(*) FROM files WHERE name=?", (initial_context_path,))
-    if cursor.fetchone()[0] == 0:
-        try:
-            with open(initial_context_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-                cursor.execute("INSERT INTO files (name, upload_date, content) VALUES (?, ?, ?)",
-                               (initial_context_path, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), text))
-                conn.commit()
-                chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-                embeddings = model.encode(chunks)
-                index.add(np.array(embeddings))
-        except Exception as e:
-            st.error(f"Failed to load initial context: {e}")
-            st.stop()
-else:
-    st.warning("Initial context file (data/initial_context.txt) not found. Please ensure it exists.")
-
-# Function to rebuild the FAISS index after deletion
-def rebuild_faiss_index():
-    global index
-    index = faiss.IndexFlatL2(dimension)
-    files = cursor.execute("SELECT content FROM files").fetchall()
-    for file_content in files:
-        content = file_content[0]
-        chunks = [content[i:i+1000] for i in range(0, len(content), 1000)]
-        embeddings = model.encode(chunks)
-        index.add(np.array(embeddings))
-
-# File processing function for RAG
+# File processing function for RAG. The upload is saved to data/ and queued
+# for background ingestion; the returned job id can be polled for status.
 def process_file(file, file_type):
     try:
-        if file_type == 'pdf':
-            reader = PyPDF2.PdfReader(file)
-            text = ''.join([page.extract_text() for page in reader.pages])
-        else:
-            text = file.read().decode('utf-8')
-        
-        text = text.replace('\n', ' ').strip()
-        
-        file_path = f"data/{file.name}"
-        with open(file_path, 'wb') as f:
-            f.write(file.getbuffer())
-        
-        chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-        embeddings = model.encode(chunks)
-        
-        global index
-        index.add(np.array(embeddings))
-        
-        cursor.execute("INSERT INTO files (name, upload_date, content) VALUES (?, ?, ?)",
-                       (file.name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), text))
-        conn.commit()
-        return chunks
+        return ingestion_queue.submit_upload(file.name, file.getbuffer(), file_type)
     except Exception as e:
         st.error(f"Failed to process file: {e}")
         return None
 
-# Query handling for RAG (used for context pages)
-def answer_query(query):
+# Query handling for RAG (used for context pages). The answer is streamed so
+# the first tokens show while the rest is still being generated.
+def stream_query_answer(query):
     try:
-        query_embedding = model.encode([query])
-        D, I = index.search(np.array(query_embedding), k=10)
-        
-        context = []
-        for idx in I[0]:
-            cursor.execute("SELECT content FROM files WHERE id=?", (idx+1,))
-            result = cursor.fetchone()
-            if result:
-                context.append(result[0][:1000])
-        
-        context_text = "\n".join(context)
-        
-        system_prompt = (
-            "You are an AI assistant for CJ Express, a convenience store chain in Thailand. "
-            "Your task is to provide accurate and insightful answers based on the provided context. "
-            "Follow these steps:\n"
-            "1. Analyze the context carefully to identify relevant information.\n"
-            "2. If the context is insufficient, clearly state that the information is not available and provide a general response based on your knowledge of retail trends.\n"
-            "3. Structure your answer in a clear and concise manner, using bullet points or paragraphs as appropriate.\n"
-            "4. Avoid speculation and focus on the provided context.\n"
-            "5. If the query is ambiguous, ask for clarification or interpret it in the most logical way."
-        )
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Context: {context_text}\n\nQuestion: {query}"}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        
-        answer = response.choices[0].message.content.strip()
-        answer = "\n".join(line.strip() for line in answer.splitlines() if line.strip())
-        return answer
+        yield from rag_pipeline.stream_answer(kb, client, query, cache=get_answer_cache())
     except Exception as e:
         st.error(f"Failed to process query: {e}")
-        return "An error occurred while processing your query."
+        yield "An error occurred while processing your query."
 
-# Function to load Excel file
-def load_excel_file(file_path):
+# Function to load an uploaded Excel file
+def load_excel_file(file):
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        df = df.dropna(how='all')
-        df = df.fillna('')
-        return df
+        return read_startup_excel(file).fillna('')
     except Exception as e:
         st.error(f"Error loading Excel file: {e}")
         return None
@@ -176,7 +161,7 @@ with st.sidebar:
     st.header("Navigation")
     page = st.radio(
         "Select a page:",
-        ["Add Context", "Ask a Question", "View Context", "Tech Disruptor Analyzer"],
+        ["Add Context", "Ask a Question", "View Context", "Tech Disruptor Analyzer", "Metrics"],
         label_visibility="collapsed"
     )
 
@@ -184,24 +169,49 @@ with st.sidebar:
 if page == "Add Context":
     st.header("Add Context")
     st.write("Upload a PDF or text file to expand the knowledge base for general queries.")
-    uploaded_file = st.file_uploader("Choose a file", type=['pdf', 'txt'])
-    if uploaded_file:
-        with st.spinner("Processing file..."):
-            result = process_file(uploaded_file, uploaded_file.type.split('/')[-1])
-        if result:
-            st.success("File processed and context updated successfully!")
+    uploaded_files = st.file_uploader("Choose a file", type=['pdf', 'txt'], accept_multiple_files=True)
+    # The uploader keeps its files across reruns, so queue each upload only once
+    submitted = st.session_state.setdefault('submitted_uploads', set())
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.file_id in submitted:
+            continue
+        job_id = process_file(uploaded_file, uploaded_file.type.split('/')[-1])
+        if job_id:
+            submitted.add(uploaded_file.file_id)
+            st.success(f"{uploaded_file.name} was queued for processing. You can keep using the app while it is ingested.")
         else:
             st.error("Failed to process the uploaded file.")
+    
+    jobs = ingestion_queue.list_jobs()
+    if jobs:
+        st.subheader("Recent Uploads")
+        jobs_df = pd.DataFrame(jobs)
+        jobs_df["progress"] = [
+            f"{job['pages_done']}/{job['pages_total']} pages" if job['pages_total'] else f"{job['pages_done']} blocks"
+            for job in jobs
+        ]
+        st.dataframe(
+            jobs_df[["id", "file_name", "status", "progress", "chunk_count", "submitted_at", "duration_seconds", "error"]],
+            use_container_width=True,
+            hide_index=True
+        )
+        # Poll while anything is still queued or running
+        if ingestion_queue.has_active_jobs():
+            time.sleep(1)
+            st.rerun()
 
 elif page == "Ask a Question":
     st.header("Ask a Question")
     st.write("Enter your question below to get insights from the knowledge base (PDFs and text files).")
     query = st.text_input("Your question:", placeholder="e.g., What are the shopping behaviors of Weekly Shoppers?")
     if query:
-        with st.spinner("Processing..."):
-            answer = answer_query(query)
         st.subheader("Answer:")
-        st.write(answer)
+        st.write_stream(stream_query_answer(query))
+        cache_stats = get_answer_cache().stats()
+        st.caption(
+            f"Answer cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} cached answers)"
+        )
         
         st.write("---")
         st.write("Was this answer helpful?")
@@ -217,44 +227,63 @@ elif page == "View Context":
     st.header("View Stored Context")
     st.write("Below is the list of all stored context files in the knowledge base.")
     
-    files = cursor.execute("SELECT id, name, upload_date, content FROM files").fetchall()
-    if files:
-        for file in files:
-            with st.expander(f"File: {file[1]} (Uploaded: {file[2]})"):
-                st.write(f"**File ID:** {file[0]}")
+    with st.expander("Index maintenance"):
+        st.write("Deleting a file only removes its own vectors. Use a full rebuild if search results look out of date; it re-encodes every stored chunk and can take several minutes.")
+        if st.button("Rebuild search index"):
+            with st.spinner("Rebuilding search index..."):
+                kb.rebuild_index()
+            st.success("Search index rebuilt.")
+    
+    # Only one page of metadata and previews is read per rerun; full text and
+    # file bytes are loaded when asked for
+    file_count = kb.count_files()
+    if file_count:
+        page_count = (file_count + FILES_PER_PAGE - 1) // FILES_PER_PAGE
+        page_number = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1)
+        st.caption(f"{file_count} files in the knowledge base")
+        files = kb.list_files(limit=FILES_PER_PAGE, offset=(page_number - 1) * FILES_PER_PAGE)
+        for file_id, name, upload_date, content_chars, chunk_count, preview in files:
+            with st.expander(f"File: {name} (Uploaded: {upload_date})"):
+                st.write(f"**File ID:** {file_id} | **Size:** {content_chars or 0:,} characters | **Chunks:** {chunk_count}")
+                show_full = st.toggle("Show full content", key=f"content_{file_id}")
+                if show_full:
+                    content = kb.get_file_content(file_id)
+                else:
+                    content = preview + ("..." if content_chars and content_chars > len(preview) else "")
                 st.text_area(
                     label="Content",
-                    value=file[3],
+                    value=content or "",
                     height=300,
                     disabled=True,
-                    label_visibility="collapsed"
+                    label_visibility="collapsed",
+                    key=f"text_{file_id}_{show_full}"
                 )
                 
                 col1, col2 = st.columns([1, 1])
+                file_path = ingestion_queue.upload_path(file_id, name)
                 with col1:
-                    file_path = f"data/{file[1]}"
-                    if os.path.exists(file_path):
+                    if not file_path or not os.path.exists(file_path):
+                        st.warning(f"File {name} not found in data/ directory.")
+                    elif st.session_state.get(f"download_{file_id}") or st.button("Prepare Download", key=f"prepare_{file_id}"):
+                        st.session_state[f"download_{file_id}"] = True
                         with open(file_path, "rb") as f:
                             st.download_button(
                                 label="Download File",
-                                data=f,
-                                file_name=file[1],
-                                mime="application/octet-stream"
+                                data=f.read(),
+                                file_name=name,
+                                mime="application/octet-stream",
+                                key=f"download_button_{file_id}"
                             )
-                    else:
-                        st.warning(f"File {file[1]} not found in data/ directory.")
                 with col2:
-                    if file[1] != "data/initial_context.txt":
-                        if st.button("Delete", key=f"delete_{file[0]}"):
-                            cursor.execute("DELETE FROM files WHERE id=?", (file[0],))
-                            conn.commit()
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                            rebuild_faiss_index()
-                            st.success(f"File {file[1]} deleted successfully!")
+                    if name != "data/initial_context.txt":
+                        if st.button("Delete", key=f"delete_{file_id}"):
+                            ingestion_queue.delete_file(file_id)
+                            st.success(f"File {name} deleted successfully!")
                             st.rerun()
                     else:
                         st.write("Initial context cannot be deleted.")
+    else:
+        st.info("No context files stored yet.")
 
 elif page == "Tech Disruptor Analyzer":
     st.header("CJ Express Tech Disruptor Analyzer")
@@ -272,30 +301,38 @@ elif page == "Tech Disruptor Analyzer":
         
         # Load Excel file
         file_path = "cmu_startups.xlsx"
+        data, data_key = None, None
         if os.path.exists(file_path):
-            if 'data' not in st.session_state:
-                st.session_state.data = load_excel_file(file_path)
-            st.success("Loaded cmu_startups.xlsx successfully!")
+            mtime = os.path.getmtime(file_path)
+            try:
+                data = get_startup_data(file_path, mtime)
+                data_key = ("file", file_path, mtime)
+                st.success("Loaded cmu_startups.xlsx successfully!")
+            except Exception as e:
+                st.error(f"Error loading Excel file: {e}")
         else:
             uploaded_file = st.file_uploader("Upload Excel file (cmu_startups.xlsx)", type=["xlsx"])
             if uploaded_file:
-                st.session_state.data = load_excel_file(uploaded_file)
+                # Parse each upload once, not on every rerun
+                if st.session_state.get('data_key') != ("upload", uploaded_file.file_id):
+                    st.session_state.data = load_excel_file(uploaded_file)
+                    st.session_state.data_key = ("upload", uploaded_file.file_id)
+                data, data_key = st.session_state.data, st.session_state.data_key
                 st.success("File uploaded successfully!")
         
-        if st.session_state.get('data') is not None:
+        if data is not None:
             st.subheader("Data Preview")
-            st.dataframe(st.session_state.data, use_container_width=True)
+            st.dataframe(data, use_container_width=True)
             
-            # Download button for local Excel file
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                st.session_state.data.to_excel(writer, index=False, sheet_name="Startup Analysis")
-            st.download_button(
-                label="Download Local Analysis as Excel",
-                data=output.getvalue(),
-                file_name="CMU_Startup_Analysis.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            # The workbook is only written when someone asks for it
+            if st.session_state.get('export_ready') == data_key or st.button("Prepare Excel Download"):
+                st.session_state.export_ready = data_key
+                st.download_button(
+                    label="Download Local Analysis as Excel",
+                    data=get_excel_export(data_key, data),
+                    file_name="CMU_Startup_Analysis.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
             
             # Chatbot-style query interface
             st.subheader("Ask a Question")
@@ -306,37 +343,55 @@ elif page == "Tech Disruptor Analyzer":
             
             if query:
                 try:
-                    data_context = st.session_state.data.to_string()
-                    
-                    system_prompt = (
-                        "You are an expert analyst for CJ Express, a Thai supermarket chain. "
-                        "Your task is to answer questions based solely on the provided Excel data about CMU startup technologies. "
-                        "Follow these steps:\n"
-                        "1. Analyze the data carefully to identify relevant information.\n"
-                        "2. If the data is insufficient, clearly state that the information is not available and avoid speculation.\n"
-                        "3. Structure your answer in a conversational, chatbot-like style, using bullet points or paragraphs as appropriate.\n"
-                        "4. Focus on the five retail pillars: Category Management, Product Development, Offline Promotion, Supply Chain/Logistics, and Store Operations.\n"
-                        "5. For questions about top technologies, rank them based on the Overall Score and relevance to the specified pillar.\n"
-                        "6. Provide clear, concise recommendations tailored to CJ Express's goals of global expansion and efficiency.\n"
-                        "7. If the query specifies a category (e.g., Category Management), prioritize technologies with high scores in that category."
-                    )
-                    
-                    response = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
+                    # Ranking and filter questions are answered locally; the LLM
+                    # only narrates the rows that were already selected
+                    ranker = get_startup_ranker(data_key, data)
+                    intent = ranker.parse(query)
+                    selected = ranker.run(intent) if intent else None
+                    if intent and selected.empty:
+                        st.subheader("Answer")
+                        st.write(f"No startups match your question ({ranker.describe(intent)}). Try a broader question.")
+                    else:
+                        if intent:
+                            data_context = selected[ranker.columns_for(intent)].to_csv(index=False)
+                            context_label = (
+                                f"Selected Startups ({ranker.describe(intent)}). These rows are already filtered and ranked; "
+                                "present them in this order and do not add, drop or re-rank startups"
+                            )
+                        else:
+                            # Send only the rows and columns relevant to the question
+                            startup_index = get_startup_index(data_key, data)
+                            data_context = startup_index.context_for(query, kb.encode_query([query])[0])
+                            context_label = "Data Context (the startups most relevant to the question)"
+                        
+                        system_prompt = (
+                            "You are an expert analyst for CJ Express, a Thai supermarket chain. "
+                            "Your task is to answer questions based solely on the provided Excel data about CMU startup technologies. "
+                            "Follow these steps:\n"
+                            "1. Analyze the data carefully to identify relevant information.\n"
+                            "2. If the data is insufficient, clearly state that the information is not available and avoid speculation.\n"
+                            "3. Structure your answer in a conversational, chatbot-like style, using bullet points or paragraphs as appropriate.\n"
+                            "4. Focus on the five retail pillars: Category Management, Product Development, Offline Promotion, Supply Chain/Logistics, and Store Operations.\n"
+                            "5. For questions about top technologies, rank them based on the Overall Score and relevance to the specified pillar.\n"
+                            "6. Provide clear, concise recommendations tailored to CJ Express's goals of global expansion and efficiency.\n"
+                            "7. If the query specifies a category (e.g., Category Management), prioritize technologies with high scores in that category."
+                        )
+                        
+                        messages = [
                             {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": f"Data Context:\n{data_context}\n\nQuestion: {query}"}
-                        ],
-                        max_tokens=1000,
-                        temperature=0.7
-                    )
-                    
-                    answer = response.choices[0].message.content.strip()
-                    answer = "\n".join(line.strip() for line in answer.splitlines() if line.strip())
-                    response_text = f"Alright, let's dive into your question: '{query}'.\n\n{answer}\n\nFeel free to ask another question!"
-                    
-                    st.subheader("Answer")
-                    st.write(response_text)
+                            {"role": "user", "content": f"{context_label}:\n{data_context}\n\nQuestion: {query}"}
+                        ]
+                        
+                        def response_stream():
+                            yield f"Alright, let's dive into your question: '{query}'.\n\n"
+                            yield from rag_pipeline.stream_chat(client, messages, max_tokens=1000, log_label="tech disruptor answer")
+                            yield "\n\nFeel free to ask another question!"
+                        
+                        st.subheader("Answer")
+                        if intent:
+                            st.caption(f"Selected locally: {ranker.describe(intent)}")
+                            st.dataframe(selected[ranker.columns_for(intent)], use_container_width=True, hide_index=True)
+                        st.write_stream(response_stream())
                 except Exception as e:
                     st.error(f"Error generating response: {e}")
         else:
@@ -410,4 +465,50 @@ elif page == "Tech Disruptor Analyzer":
         The CJ Express Global Tech Disruptor Analyzer empowers CJ Express to make data-driven decisions by querying a comprehensive dataset of CMU spin-off startups. By focusing on pre-analyzed data, the tool eliminates the need for real-time scraping or analysis, providing a user-friendly interface for strategic innovation planning. Its educational design ensures users understand the data’s origins and potential, while the future scope outlines a path for broader adoption across other universities and enhanced functionalities.
 
         For questions or support, contact the CJ Express innovation team or refer to the GitHub repository for technical details.
-        """)
\ No newline at end of file
+        """)
+
+elif page == "Metrics":
+    st.header("Metrics")
+    st.write(f"Stage timings and token usage recorded by every app in `{instrumentation.METRICS_PATH}`.")
+    periods = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400, "All time": None}
+    period = st.selectbox("Period", list(periods), index=1)
+    since = time.time() - periods[period] if periods[period] else None
+    events = instrumentation.load_events(since=since)
+    spans = pd.DataFrame([event for event in events if event.get("type") == "span"])
+    usage = pd.DataFrame([event for event in events if event.get("type") == "usage"])
+
+    st.subheader("Cost per App")
+    if usage.empty:
+        st.info("No token usage recorded in this period.")
+    else:
+        cost = usage.groupby(["app", "model"]).agg(
+            calls=("cost_usd", "size"),
+            prompt_tokens=("prompt_tokens", "sum"),
+            completion_tokens=("completion_tokens", "sum"),
+            cost_usd=("cost_usd", "sum"),
+        ).reset_index()
+        st.dataframe(cost, use_container_width=True, hide_index=True)
+        st.metric("Total cost (USD)", f"{usage['cost_usd'].sum():.4f}")
+
+    st.subheader("Stage Latency")
+    if spans.empty:
+        st.info("No timings recorded in this period.")
+    else:
+        spans["ms"] = spans["seconds"] * 1000
+        latency = spans.groupby(["app", "span"])["ms"].agg(
+            count="size",
+            p50=lambda ms: ms.quantile(0.5),
+            p95=lambda ms: ms.quantile(0.95),
+            p99=lambda ms: ms.quantile(0.99),
+            max="max",
+        ).reset_index()
+        st.dataframe(latency.round(1), use_container_width=True, hide_index=True)
+
+        labels = sorted(f"{app} / {name}" for app, name in spans.groupby(["app", "span"]).groups)
+        selected_span = st.selectbox("Histogram for", labels)
+        app_name, span_name = selected_span.split(" / ", 1)
+        values = spans[(spans["app"] == app_name) & (spans["span"] == span_name)]["ms"]
+        counts, edges = np.histogram(values, bins=min(30, max(1, len(values))))
+        histogram = pd.DataFrame({"requests": counts}, index=[f"{edge:.0f}" for edge in edges[:-1]])
+        histogram.index.name = "ms"
+        st.bar_chart(histogram)
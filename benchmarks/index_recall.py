@@ -0,0 +1,133 @@
+"""Compare the knowledge base index types against exact flat search.
+
+Reports recall@10, per-query latency, build time and serialized index size for
+each configuration, using the same constructors the app uses. Vectors are
+either synthetic clustered embeddings or the cached chunk embeddings from an
+existing context.db.
+
+    python benchmarks/index_recall.py --vectors 100000
+    python benchmarks/index_recall.py --db context.db --output recall.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from knowledge_base import DIMENSION, choose_index_type, configure_search, ivf_nlist, new_index  # noqa: E402
+
+K = 10
+
+
+def synthetic_vectors(n_vectors, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n_vectors // 500)
+    centers = rng.standard_normal((n_clusters, DIMENSION)).astype('float32')
+    labels = rng.integers(0, n_clusters, n_vectors + n_queries)
+    data = centers[labels] + 0.5 * rng.standard_normal((n_vectors + n_queries, DIMENSION)).astype('float32')
+    return data[:n_vectors], data[n_vectors:]
+
+
+# Use the real chunk embeddings from the embedding cache; queries are held out
+def cached_vectors(db_path, n_queries, seed=0):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT vector FROM embedding_cache").fetchall()
+    conn.close()
+    if len(rows) <= n_queries:
+        raise SystemExit(f"{db_path} has only {len(rows)} cached embeddings")
+    data = np.vstack([np.frombuffer(row[0], dtype='float16').astype('float32') for row in rows])
+    np.random.default_rng(seed).shuffle(data)
+    return data[n_queries:], data[:n_queries]
+
+
+def configurations(n_vectors):
+    configs = [("flat", {})]
+    if choose_index_type(n_vectors, 'ivf') == 'ivf':
+        configs += [("ivf", {"nprobe": nprobe}) for nprobe in (4, 16, 64)]
+    if choose_index_type(n_vectors, 'ivfpq') == 'ivfpq':
+        configs += [("ivfpq", {"nprobe": nprobe}) for nprobe in (16, 64)]
+    configs += [("hnsw", {"ef_search": ef}) for ef in (32, 64, 128)]
+    return configs
+
+
+def build(kind, vectors):
+    index = new_index(kind, len(vectors))
+    start = time.perf_counter()
+    if not index.is_trained:
+        nlist = faiss.extract_index_ivf(index).nlist
+        sample = vectors[np.random.default_rng(1).permutation(len(vectors))[:256 * nlist]]
+        index.train(sample)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    return index, time.perf_counter() - start
+
+
+# Queries run one at a time on a single thread, as they are served per request
+def measure(index, queries, ground_truth):
+    threads = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(1)
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), K)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0].tolist()) & set(ground_truth[i].tolist()))
+    faiss.omp_set_num_threads(threads)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "recall_at_10": hits / (len(queries) * K),
+        "latency_ms_mean": float(latencies_ms.mean()),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000, help="number of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--db", help="read cached embeddings from this context.db instead of generating them")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.db:
+        vectors, queries = cached_vectors(args.db, args.queries)
+    else:
+        vectors, queries = synthetic_vectors(args.vectors, args.queries)
+    print(f"{len(vectors)} vectors, {len(queries)} queries, nlist={ivf_nlist(len(vectors))}")
+
+    exact = new_index('flat')
+    exact.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    _, ground_truth = exact.search(queries, K)
+
+    built = {}
+    results = []
+    print(f"{'index':<8}{'params':<18}{'recall@10':>10}{'mean ms':>10}{'p95 ms':>10}{'build s':>10}{'size MB':>10}")
+    for kind, params in configurations(len(vectors)):
+        if kind not in built:
+            built[kind] = build(kind, vectors)
+        index, build_seconds = built[kind]
+        configure_search(index, **params)
+        result = {
+            "index": kind,
+            "params": params,
+            **measure(index, queries, ground_truth),
+            "build_seconds": build_seconds,
+            "size_mb": faiss.serialize_index(index).nbytes / 1e6,
+        }
+        results.append(result)
+        params_text = ",".join(f"{key}={value}" for key, value in params.items()) or "-"
+        print(f"{kind:<8}{params_text:<18}{result['recall_at_10']:>10.3f}{result['latency_ms_mean']:>10.2f}"
+              f"{result['latency_ms_p95']:>10.2f}{build_seconds:>10.1f}{result['size_mb']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "queries": len(queries), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
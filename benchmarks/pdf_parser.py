@@ -0,0 +1,218 @@
+"""Speed and output of the CMU startup PDF parser against the original.
+
+A synthetic document in the layout of the CMU spin-off report (sections,
+industry headings, numbered startups with multi-line descriptions) is parsed
+by the original line-rescanning parser, kept below, and by the single-pass
+parser in startup_pdf.py. The two must return identical startups; the
+report gives the time of each.
+
+With pdfplumber installed, the document is also written as a PDF and page
+text extraction is timed sequentially and with the process pool:
+
+    python benchmarks/pdf_parser.py --pages 400 --output pdf_parser.json
+    python benchmarks/pdf_parser.py --pages 400 --no-pdf    # parsing only
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import startup_pdf  # noqa: E402
+
+LINES_PER_PAGE = 48
+SECTIONS = [
+    "Recent and Selected Acquisitions/Exits of CMU spin-off companies",
+    "CMU spin-off companies backed by venture capital/ institutional investment",
+    "CMU early-stage spin-off companies without institutional investment",
+    "Pipeline: Emerging Spin-offs",
+]
+INDUSTRIES = ["Cleantech/energy", "Electronics/Semiconductors", "Robotics", "Social Networking/Mobile Computing",
+              "Software and AI", "Medical Devices/Biotech", "Chemistry and Materials Science", "Social Ventures"]
+WORDS = ("robotic sensing platform machine learning retail logistics battery materials imaging diagnostics "
+         "autonomous vehicle software analytics manufacturing semiconductor wireless network energy storage "
+         "startup founded faculty research licensed technology commercial customers investors").split()
+
+
+# The parser as it was before startup_pdf.py, over already extracted page texts
+def legacy_parse(page_texts, checklist):
+    startups = []
+    current_section = ""
+    current_industry = ""
+    for page_num, text in enumerate(page_texts, 1):
+        lines = text.split("\n") if text else []
+        section_pattern = re.compile(r"^(Recent and Selected Acquisitions/Exits of CMU spin-off companies|CMU spin-off companies backed by venture capital/ institutional investment|CMU early-stage spin-off companies without institutional investment|Pipeline: Emerging Spin-offs)$")
+        industry_pattern = re.compile(r"^(Cleantech/energy|Electronics/Semiconductors|Robotics|Social Networking/Mobile Computing|Software and AI|Medical Devices/Biotech|Chemistry and Materials Science|Social Ventures)$")
+        startup_pattern = re.compile(r"^\d+\.\s+([A-Za-z0-9\s]+(?:, Inc\.| LLC)?(?:\s+\(Joint with .*\))?):")
+        for i, line in enumerate(lines):
+            line = line.strip()
+            section_match = section_pattern.match(line)
+            if section_match:
+                current_section = section_match.group(1)
+                current_industry = ""
+                continue
+            if current_section != "Recent and Selected Acquisitions/Exits of CMU spin-off companies":
+                industry_match = industry_pattern.match(line)
+                if industry_match:
+                    current_industry = industry_match.group(1)
+                    continue
+            startup_match = startup_pattern.match(line)
+            if startup_match and current_section:
+                name = startup_match.group(1).strip()
+                if name not in checklist:
+                    continue
+                description_start = line.find(":") + 1
+                description = line[description_start:].strip()
+                j = i + 1
+                while j < len(lines) and not (startup_pattern.match(lines[j]) or industry_pattern.match(lines[j]) or section_pattern.match(lines[j])):
+                    description += " " + lines[j].strip()
+                    j += 1
+                startups.append({
+                    "Company Name": name,
+                    "Description": description.strip(),
+                    "Section": current_section,
+                    "Industry Category": current_industry if current_industry else "N/A",
+                    "Website": ""
+                })
+    return startups
+
+
+# Page texts in the report's layout, plus the checklist of about half the
+# startup names. A few headings are indented; stripped they still switch the
+# industry, but they do not end the description before them, which the
+# single-pass parser must reproduce.
+def synthetic_document(n_pages, seed):
+    rng = random.Random(seed)
+    lines = [SECTIONS[1]]
+    names = []
+    while len(lines) < n_pages * LINES_PER_PAGE:
+        if rng.random() < 0.01:
+            lines.append(rng.choice(SECTIONS))
+        if rng.random() < 0.08:
+            lines.append(("  " if rng.random() < 0.1 else "") + rng.choice(INDUSTRIES))
+        name = f"Startup {len(names) + 1} " + rng.choice(["Robotics", "Labs", "Technologies", "Systems"])
+        name += rng.choice(["", ", Inc.", " LLC"])
+        names.append(name)
+        lines.append(f"{len(names)}. {name}: " + " ".join(rng.choices(WORDS, k=10)))
+        for _ in range(rng.randint(1, 8)):
+            lines.append(" ".join(rng.choices(WORDS, k=rng.randint(6, 14))))
+    pages = ["\n".join(lines[i:i + LINES_PER_PAGE]) for i in range(0, len(lines), LINES_PER_PAGE)]
+    checklist = {name for name in names if rng.random() < 0.5}
+    return pages, checklist
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# Minimal PDF with one Helvetica text line per page line, enough for
+# pdfplumber to extract the same lines back
+def write_pdf(path, page_texts):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for text in page_texts:
+        stream = "BT /F1 8 Tf 10 TL 30 810 Td " + " ".join(
+            f"({_pdf_escape(line)}) Tj T*" for line in text.split("\n")) + " ET"
+        data = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def measure_extraction(page_texts, checklist, workers, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic_cmu.pdf")
+        write_pdf(path, page_texts)
+        sequential, sequential_result = best_of(repeat, lambda: startup_pdf.parse_startup_pages(
+            startup_pdf.iter_page_texts(path, workers=1), checklist))
+        pooled, pooled_result = best_of(repeat, lambda: startup_pdf.parse_startup_pages(
+            startup_pdf.iter_page_texts(path, workers=workers), checklist))
+    return {
+        "workers": workers,
+        "sequential_seconds": sequential,
+        "pool_seconds": pooled,
+        "speedup": sequential / pooled,
+        "identical": sequential_result == pooled_result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=startup_pdf.PDF_WORKERS)
+    parser.add_argument("--no-pdf", action="store_true", help="skip the PDF extraction timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    page_texts, checklist = synthetic_document(args.pages, args.seed)
+    legacy_seconds, legacy = best_of(args.repeat, lambda: legacy_parse(page_texts, checklist))
+    pages = [(page_num, text, None) for page_num, text in enumerate(page_texts, 1)]
+    single_pass_seconds, single_pass = best_of(
+        args.repeat, lambda: startup_pdf.parse_startup_pages(pages, checklist))
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pages": len(page_texts),
+        "startups": len(single_pass),
+        "identical": legacy == single_pass,
+        "parse": {
+            "legacy_seconds": legacy_seconds,
+            "single_pass_seconds": single_pass_seconds,
+            "speedup": legacy_seconds / single_pass_seconds,
+        },
+    }
+    print(f"{report['pages']} pages, {report['startups']} checklist startups, identical output: {report['identical']}")
+    print(f"parse: legacy {legacy_seconds * 1000:.1f} ms, single pass {single_pass_seconds * 1000:.1f} ms "
+          f"({report['parse']['speedup']:.1f}x)")
+
+    if not args.no_pdf:
+        try:
+            report["extraction"] = measure_extraction(page_texts, checklist, args.workers, max(1, args.repeat // 2))
+        except ImportError as e:
+            print(f"Skipping PDF extraction timings: {e}")
+        else:
+            extraction = report["extraction"]
+            print(f"extract+parse: sequential {extraction['sequential_seconds']:.2f} s, "
+                  f"{extraction['workers']} processes {extraction['pool_seconds']:.2f} s "
+                  f"({extraction['speedup']:.1f}x), identical output: {extraction['identical']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["identical"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Ingestion throughput and query latency of the RAG pipeline.
+
+For each corpus size a fresh knowledge base is built in a temporary directory
+from synthetic pages, then a fixed set of questions is answered against it
+with the chat endpoint served by openai_stub.py. Reported per size:
+
+- ingestion pages/s and chunks/s (chunking, embedding, SQLite and FAISS inserts)
+- embedding throughput of the encoder alone
+- index rebuild time from cached embeddings
+- p50/p95/p99 query latency for each stage (keyword search, question
+  embedding, vector search and chunk fetch, context packing, LLM call) and in
+  total, taken from the spans rag_pipeline.answer_query records. A question
+  answered from keyword hits alone counts 0 for the stages it skips.
+- peak RSS of the process so far
+
+Before timing anything it checks that context packing never leaves a
+question without context: the best passage, even when adjacent chunks merge
+into more than the token budget, must reach the prompt. The exit status is 1
+if it does not.
+
+    python benchmarks/rag_throughput.py --sizes small medium --output rag.json
+    python benchmarks/rag_throughput.py --encoder hash   # pipeline overhead without the model
+    python benchmarks/rag_throughput.py --encoder onnx-int8
+
+The real encoder is used by default. `--encoder onnx-int8` uses the exported
+int8 model from encoders.py instead, and `--encoder hash` swaps in a fast
+deterministic hashing encoder so the rest of the pipeline can be measured on
+its own.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import instrumentation  # noqa: E402
+import rag_pipeline  # noqa: E402
+from database import Database  # noqa: E402
+from knowledge_base import DIMENSION, EMBEDDING_BATCH_SIZE, MODEL_NAME, KnowledgeBase, choose_index_type  # noqa: E402
+from openai_stub import start_stub_server  # noqa: E402
+
+# files, pages per file, characters per page
+CORPUS_SIZES = {
+    "small": (5, 20, 2000),
+    "medium": (20, 50, 2000),
+    "large": (50, 200, 2000),
+}
+WORDS = ("retail convenience store customer basket loyalty promotion supply chain logistics inventory "
+         "shelf category assortment pricing margin delivery warehouse demand forecast trend Bangkok "
+         "Thailand snack beverage fresh food payment mobile app membership point coupon").split()
+STAGES = ("keyword", "embed", "retrieve", "pack", "llm", "total")
+# Instrumentation spans making up each stage
+STAGE_SPANS = {
+    "keyword": ("keyword_search",),
+    "embed": ("embed",),
+    "retrieve": ("index_search", "sqlite_fetch"),
+    "pack": ("pack_context",),
+    "llm": ("llm",),
+    "total": ("rag_query",),
+}
+
+
+# Hash of the text's words into a fixed random projection: cheap, deterministic
+# and similar for texts that share words
+class HashEncoder:
+    def __init__(self, dimension=DIMENSION):
+        self.dimension = dimension
+
+    def encode(self, texts, **kwargs):
+        out = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = int(hashlib.blake2b(word.encode('utf-8'), digest_size=8).hexdigest(), 16)
+                out[row, digest % self.dimension] += 1.0 if digest & 1 else -1.0
+        return out
+
+
+def synthetic_page(rng, n_chars):
+    words = []
+    length = 0
+    while length < n_chars:
+        word = WORDS[rng.integers(len(WORDS))] if rng.random() > 0.02 else f"SKU-{rng.integers(100000):05d}"
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:n_chars]
+
+
+def questions(rng, n):
+    templates = ["What are the trends in {} and {}?", "How can we improve {} for {}?",
+                 "Summarise what the documents say about {} {}.", "Which stores stock {}? {}"]
+    result = []
+    for i in range(n):
+        template = templates[i % len(templates)]
+        if "stock" in template:
+            result.append(template.format(f"SKU-{rng.integers(100000):05d}", WORDS[rng.integers(len(WORDS))]))
+        else:
+            result.append(template.format(WORDS[rng.integers(len(WORDS))], WORDS[rng.integers(len(WORDS))]))
+    return result
+
+
+def percentiles(values):
+    values_ms = np.array(values) * 1000
+    return {f"p{p}_ms": float(np.percentile(values_ms, p)) for p in (50, 95, 99)}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure_embedding(encoder, rng, n_texts=256, chunk_chars=1000):
+    texts = [synthetic_page(rng, chunk_chars) for _ in range(n_texts)]
+    encoder.encode(texts[:8])  # warm-up
+    start = time.perf_counter()
+    encoder.encode(texts)
+    return n_texts / (time.perf_counter() - start)
+
+
+def ingest(kb, rng, n_files, pages_per_file, page_chars):
+    pages_total = 0
+    chunks_total = 0
+    start = time.perf_counter()
+    for file_number in range(n_files):
+        pages = [synthetic_page(rng, page_chars) for _ in range(pages_per_file)]
+        file_id = kb.create_file(f"synthetic_{file_number}.txt")
+        chunks_total += kb.ingest_pages(file_id, iter(pages), pages_per_file)
+        pages_total += pages_per_file
+    elapsed = time.perf_counter() - start
+    return {
+        "files": n_files,
+        "pages": pages_total,
+        "chunks": chunks_total,
+        "seconds": elapsed,
+        "pages_per_second": pages_total / elapsed,
+        "chunks_per_second": chunks_total / elapsed,
+    }
+
+
+# Answer through rag_pipeline.answer_query and sum the seconds of its spans
+# per stage
+def timed_query(kb, client, question):
+    with instrumentation.collect() as events:
+        rag_pipeline.answer_query(kb, client, question)
+    seconds = {}
+    for event in events:
+        if event["type"] == "span":
+            seconds[event["span"]] = seconds.get(event["span"], 0.0) + event["seconds"]
+    return {stage: sum(seconds.get(name, 0.0) for name in names) for stage, names in STAGE_SPANS.items()}
+
+
+# Seven adjacent 1000-character chunks of one file merge into a passage over
+# the default budget; the top hit must still be packed, within the budget
+def check_context_packing(token_budget=rag_pipeline.CONTEXT_TOKEN_BUDGET):
+    rng = np.random.default_rng(0)
+    hits = [{"chunk_id": i, "file_id": 1, "file_name": "report.txt", "offset": i * 1000,
+             "text": synthetic_page(rng, 1000), "distance": 0.1 + i / 100} for i in range(7)]
+    best = hits[3]
+    hits.insert(0, hits.pop(3))
+    context_text, context_tokens, passages = rag_pipeline.pack_context(hits, token_budget)
+    return passages == 1 and 0 < context_tokens <= token_budget and best["text"][:200] in context_text
+
+
+def run_size(name, encoder, client, n_queries, seed):
+    n_files, pages_per_file, page_chars = CORPUS_SIZES[name]
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "context.db"))
+        kb = KnowledgeBase(encoder, db, index_path=os.path.join(directory, "context.faiss"))
+        ingestion = ingest(kb, rng, n_files, pages_per_file, page_chars)
+
+        start = time.perf_counter()
+        kb.rebuild_index()
+        rebuild_seconds = time.perf_counter() - start
+
+        samples = {stage: [] for stage in STAGES}
+        for question in questions(rng, n_queries):
+            for stage, seconds in timed_query(kb, client, question).items():
+                samples[stage].append(seconds)
+        result = {
+            "size": name,
+            "ingestion": ingestion,
+            "index_type": choose_index_type(kb.index.ntotal),
+            "vectors": kb.index.ntotal,
+            "index_rebuild_seconds": rebuild_seconds,
+            "query_latency": {stage: percentiles(values) for stage, values in samples.items()},
+            "queries": n_queries,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        db.close()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(CORPUS_SIZES), default=["small", "medium"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--encoder", choices=["model", "onnx-int8", "hash"], default="model")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the stub LLM waits per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    # Spans are collected in memory; keep benchmark runs out of the app metrics file
+    instrumentation.METRICS_ENABLED = False
+
+    from openai import OpenAI
+    if args.encoder == "hash":
+        encoder = HashEncoder()
+    elif args.encoder == "onnx-int8":
+        from encoders import OnnxEncoder
+        encoder = OnnxEncoder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(MODEL_NAME)
+    server, base_url = start_stub_server(latency=args.llm_latency)
+    client = OpenAI(api_key="stub", base_url=base_url)
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "encoder": {"model": MODEL_NAME, "onnx-int8": f"{MODEL_NAME}:onnx-int8"}.get(args.encoder, "hash"),
+        "embedding_batch_size": EMBEDDING_BATCH_SIZE,
+        "llm_latency_seconds": args.llm_latency,
+        "embedding_texts_per_second": measure_embedding(encoder, np.random.default_rng(args.seed)),
+        "results": [],
+    }
+    report["context_packing_ok"] = check_context_packing()
+    print(f"context packing check: {'ok' if report['context_packing_ok'] else 'FAILED'}")
+    print(f"embedding: {report['embedding_texts_per_second']:.1f} texts/s")
+    print(f"{'size':<8}{'pages/s':>10}{'chunks/s':>10}{'rebuild s':>11}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'RSS MB':>9}")
+    for name in args.sizes:
+        result = run_size(name, encoder, client, args.queries, args.seed)
+        report["results"].append(result)
+        total = result["query_latency"]["total"]
+        print(f"{name:<8}{result['ingestion']['pages_per_second']:>10.1f}"
+              f"{result['ingestion']['chunks_per_second']:>10.1f}{result['index_rebuild_seconds']:>11.2f}"
+              f"{total['p50_ms']:>9.1f}{total['p95_ms']:>9.1f}{total['p99_ms']:>9.1f}{result['peak_rss_mb']:>9.0f}")
+        for stage in STAGES[:-1]:
+            latency = result["query_latency"][stage]
+            print(f"    {stage:<10}p50 {latency['p50_ms']:.2f} ms  p95 {latency['p95_ms']:.2f} ms"
+                  f"  p99 {latency['p99_ms']:.2f} ms")
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["context_packing_ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
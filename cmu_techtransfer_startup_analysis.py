@@ -1,18 +1,43 @@
 import streamlit as st
 from openai import OpenAI
-import pdfplumber
 import re
 from typing import List, Dict
-import time
 import pandas as pd
 import io
 import json
 import base64
 import numpy as np
+import os
+import instrumentation
+import analysis_batch
+from analysis_checkpoint import AnalysisCheckpoint, checkpoint_key
+from openai_rate_limit import RateLimiter, call_with_backoff, estimate_tokens, iter_concurrent
+from startup_pdf import iter_page_texts, parse_startup_pages
+
+instrumentation.set_app("cmu_analysis")
 
 # Set up OpenAI API (use environment variables in production)
 client = OpenAI(api_key="***")
 
+# Startups are analysed ANALYSIS_CONCURRENCY at a time, kept under the
+# account's requests- and tokens-per-minute limits for ANALYSIS_MODEL
+ANALYSIS_MODEL = "gpt-4-turbo"
+ANALYSIS_MAX_TOKENS = 4096
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
+ANALYSIS_RPM = int(os.getenv("ANALYSIS_RPM", "500"))
+ANALYSIS_TPM = int(os.getenv("ANALYSIS_TPM", "150000"))
+# Shared by every session of this process, since the limits are per account
+rate_limiter = RateLimiter(ANALYSIS_RPM, ANALYSIS_TPM)
+# Finished analyses are saved here as they arrive and reused by later runs.
+# Bump PROMPT_VERSION whenever build_prompt changes so old answers are redone.
+ANALYSIS_CHECKPOINT_PATH = os.getenv("ANALYSIS_CHECKPOINT_PATH", "analysis_checkpoint.jsonl")
+PROMPT_VERSION = 1
+# Batch jobs (requests, outputs and Excel results) live in subdirectories here.
+# ANALYSIS_BATCH_BACKEND is "openai" for the Batch API or "local" for the
+# file-based stand-in used in testing.
+ANALYSIS_BATCH_DIR = os.getenv("ANALYSIS_BATCH_DIR", "batch_jobs")
+ANALYSIS_BATCH_BACKEND = os.getenv("ANALYSIS_BATCH_BACKEND", "openai")
+
 # CJ Express Context
 CJ_EXPRESS_CONTEXT = """
 CJ Express, a Thai supermarket chain, aims to disrupt global retail with high-tech solutions. Targets: mid-high to low-income, multi-generational, diverse lifestyles (e.g., trendy women, pet lovers). Focus: (1) Category Management (optimizing product assortment), (2) Product Development (innovative offerings), (3) Offline Promotion (in-store engagement), (4) Supply Chain/Logistics (efficient distribution), (5) Store Operations (streamlined processes). Goals: global expansion, efficiency, customer experience (3-5 years).
@@ -51,75 +76,18 @@ CHECKLIST_STARTUPS = {
     "Wombat Security Technologies", "Wood Wide AI", "YinzCam", "Ziel Therapeutics"
 }
 
-# Function to parse the PDF and extract startups with descriptions
+# Function to parse the PDF and extract startups with descriptions. Pages are
+# extracted in parallel and parsed in one streaming pass (see startup_pdf.py).
 def extract_startups_from_document(pdf_path: str) -> List[Dict]:
-    startups = []
-    current_section = ""
-    current_industry = ""
-    
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, 1):
-            try:
-                text = page.extract_text()
-                lines = text.split("\n") if text else []
-                
-                # Regex patterns
-                section_pattern = re.compile(r"^(Recent and Selected Acquisitions/Exits of CMU spin-off companies|CMU spin-off companies backed by venture capital/ institutional investment|CMU early-stage spin-off companies without institutional investment|Pipeline: Emerging Spin-offs)$")
-                industry_pattern = re.compile(r"^(Cleantech/energy|Electronics/Semiconductors|Robotics|Social Networking/Mobile Computing|Software and AI|Medical Devices/Biotech|Chemistry and Materials Science|Social Ventures)$")
-                startup_pattern = re.compile(r"^\d+\.\s+([A-Za-z0-9\s]+(?:, Inc\.| LLC)?(?:\s+\(Joint with .*\))?):")
-                
-                for i, line in enumerate(lines):
-                    line = line.strip()
-                    
-                    # Identify section
-                    section_match = section_pattern.match(line)
-                    if section_match:
-                        current_section = section_match.group(1)
-                        current_industry = ""
-                        continue
-                    
-                    # Identify industry
-                    if current_section != "Recent and Selected Acquisitions/Exits of CMU spin-off companies":
-                        industry_match = industry_pattern.match(line)
-                        if industry_match:
-                            current_industry = industry_match.group(1)
-                            continue
-                    
-                    # Identify startup
-                    startup_match = startup_pattern.match(line)
-                    if startup_match and current_section:
-                        name = startup_match.group(1).strip()
-                        if name not in CHECKLIST_STARTUPS:
-                            continue
-                        description_start = line.find(":") + 1
-                        description = line[description_start:].strip()
-                        
-                        # Collect full description
-                        j = i + 1
-                        while j < len(lines) and not (startup_pattern.match(lines[j]) or industry_pattern.match(lines[j]) or section_pattern.match(lines[j])):
-                            description += " " + lines[j].strip()
-                            j += 1
-                        
-                        startups.append({
-                            "Company Name": name,
-                            "Description": description.strip(),
-                            "Section": current_section,
-                            "Industry Category": current_industry if current_industry else "N/A",
-                            "Website": ""  # No website data in PDF
-                        })
-            except Exception as e:
-                st.error(f"Error processing page {page_num}: {str(e)}")
-                continue
-    
-    return startups
+    return parse_startup_pages(
+        iter_page_texts(pdf_path),
+        CHECKLIST_STARTUPS,
+        on_error=lambda page_num, error: st.error(f"Error processing page {page_num}: {error}")
+    )
 
 # GPT Analysis Function (from analysis_app.py, adapted for PDF input)
-def analyze_with_gpt(startups: List[Dict], output_file: str = "raw_gpt_outputs.json") -> List[Dict]:
-    results = []
-    raw_outputs = []
-    
-    for startup in startups:
-        prompt = f"""
+def build_prompt(startup: Dict) -> str:
+    return f"""
 {CJ_EXPRESS_CONTEXT}
 
 Analyze the following startup for relevance to CJ Express’s retail goals based solely on its description. **Return the analysis as a JSON object enclosed in triple backticks (```), with no additional text or labels outside the JSON (e.g., do not add 'json')**. For each of the five pillars (Category Management, Product Development, Offline Promotion, Supply Chain/Logistics, Store Operations), evaluate **how the startup’s technology could directly or indirectly benefit CJ Express**, even if the connection is subtle or long-term. Provide detailed reasoning for each pillar, avoiding blanket 'no relevance' unless truly inapplicable. Assign scores (0-10) reflecting potential impact, and calculate the Overall Score as a weighted sum (Category*0.3125 + Product*0.3125 + Promotion*0.1875 + Supply*0.125 + Operations*0.0625), then multiply by 10 to scale to 0-100. Use this exact structure:
@@ -147,56 +115,209 @@ Analyze the following startup for relevance to CJ Express’s retail goals based
 Startup Description:
 {startup['Company Name']} ({startup['Section']}, {startup['Industry Category']}): {startup['Description']}
 """
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=4096,
-                temperature=0.5
-            )
-            output = response.choices[0].message.content.strip()
-            if not output.startswith("```") or not output.endswith("```"):
-                output = f"```{output}```"
-            raw_outputs.append({
-                "company": startup["Company Name"],
-                "raw_output": output
-            })
+
+# Placeholder row for a startup whose analysis request failed
+def failed_result(startup: Dict) -> Dict:
+    return {
+        "Company": startup["Company Name"],
+        "Technology": "API Failure",
+        "Ability": "N/A",
+        "Summary": "Analysis failed due to API error",
+        "Relevancy to Retail": "Not assessed",
+        "Category Management Score": 0,
+        "Category Management Reasoning": "Error",
+        "Product Development Score": 0,
+        "Product Development Reasoning": "Error",
+        "Offline Promotion Score": 0,
+        "Offline Promotion Reasoning": "Error",
+        "Supply Chain/Logistics Score": 0,
+        "Supply Chain/Logistics Reasoning": "Error",
+        "Store Operations Score": 0,
+        "Store Operations Reasoning": "Error",
+        "Overall Score": 0,
+        "Category": startup["Section"],
+        "Industry": startup["Industry Category"]
+    }
+
+# Wrap a reply in ``` the way parse_gpt_output expects
+def fence_output(output: str) -> str:
+    output = output.strip()
+    if not output.startswith("```") or not output.endswith("```"):
+        output = f"```{output}```"
+    return output
+
+# Chat completion arguments for one startup's prompt, shared by the direct
+# and batch paths
+def analysis_request_body(prompt: str) -> Dict:
+    return {
+        "model": ANALYSIS_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": ANALYSIS_MAX_TOKENS,
+        "temperature": 0.5
+    }
+
+# Checkpoint key: the company plus everything that goes into its prompt
+def analysis_key(startup: Dict) -> str:
+    return checkpoint_key(startup["Company Name"], startup["Section"], startup["Industry Category"],
+                          startup["Description"], PROMPT_VERSION, ANALYSIS_MODEL)
+
+# parse_gpt_output marks a reply it could not use by this Summary prefix
+PARSE_FAILED_PREFIX = "Parsing failed"
+
+def parse_failed(result: Dict) -> bool:
+    return str(result.get("Summary", "")).startswith(PARSE_FAILED_PREFIX)
+
+# Whether a checkpoint record can stand in for asking GPT: a parsed result,
+# or a raw reply saved before it was parsed. A reply that failed to parse is
+# not, so the startup is sent again on the next run.
+def is_reusable(record) -> bool:
+    if record is None or record.get("parse_failed"):
+        return False
+    return "result" not in record or not parse_failed(record["result"])
+
+# Save a parsed reply to the checkpoint. A parse failure is saved flagged and
+# without a result, keeping the raw reply for inspection only.
+def save_analysis(checkpoint: AnalysisCheckpoint, startup: Dict, raw_output: str, result: Dict):
+    fields = {"company": startup["Company Name"], "model": ANALYSIS_MODEL, "prompt_version": PROMPT_VERSION,
+              "raw_output": raw_output}
+    if parse_failed(result):
+        checkpoint.save(analysis_key(startup), **fields, parse_failed=True)
+    else:
+        checkpoint.save(analysis_key(startup), **fields, result=result)
+
+# Ask GPT about one startup and return its raw output wrapped in ```. Runs on
+# a worker thread, so it must not call Streamlit. The raw output is
+# checkpointed here, before the caller sees it, so it survives a rerun.
+def request_analysis(startup: Dict, limiter: RateLimiter = rate_limiter, trace: str = None,
+                     checkpoint: AnalysisCheckpoint = None) -> str:
+    prompt = build_prompt(startup)
+    estimated_tokens = estimate_tokens(prompt) + ANALYSIS_MAX_TOKENS
+
+    def create():
+        # Every attempt, retries included, counts against the limits
+        limiter.acquire(estimated_tokens)
+        with instrumentation.span("llm", trace=trace, stage="startup analysis", company=startup["Company Name"]):
+            return client.with_options(max_retries=0).chat.completions.create(**analysis_request_body(prompt))
+
+    response = call_with_backoff(create)
+    instrumentation.record_usage("startup analysis", ANALYSIS_MODEL, response.usage, trace=trace)
+    if response.usage:
+        limiter.refund(estimated_tokens - response.usage.total_tokens)
+    output = response.choices[0].message.content
+    output = fence_output(output)
+    if checkpoint is not None:
+        checkpoint.save(analysis_key(startup), company=startup["Company Name"], model=ANALYSIS_MODEL,
+                        prompt_version=PROMPT_VERSION, raw_output=output)
+    return output
+
+# Analyse startups concurrently; results come back in input order. Startups
+# with a usable checkpoint record are not sent again, and each new result is
+# saved as soon as it is parsed. on_progress(done, total) is called on the
+# calling thread, counting reused results as done.
+def analyze_with_gpt(startups: List[Dict], output_file: str = "raw_gpt_outputs.json",
+                     concurrency: int = ANALYSIS_CONCURRENCY, on_progress=None,
+                     checkpoint: AnalysisCheckpoint = None) -> List[Dict]:
+    if checkpoint is None:
+        checkpoint = AnalysisCheckpoint(ANALYSIS_CHECKPOINT_PATH)
+    results = [None] * len(startups)
+    raw_outputs = [None] * len(startups)
+    trace = instrumentation.current_trace()
+    
+    # Record the result for one reply; False if it could not be parsed
+    def finish(index, output):
+        startup = startups[index]
+        record = checkpoint.get(analysis_key(startup))
+        if is_reusable(record) and "result" in record:
+            result = record["result"]
+        else:
             result = parse_gpt_output(output, startup)
-            results.append(result)
-        except Exception as e:
-            st.error(f"OpenAI API Error for {startup['Company Name']}: {str(e)}")
-            result = {
-                "Company": startup["Company Name"],
-                "Technology": "API Failure",
-                "Ability": "N/A",
-                "Summary": "Analysis failed due to API error",
-                "Relevancy to Retail": "Not assessed",
-                "Category Management Score": 0,
-                "Category Management Reasoning": "Error",
-                "Product Development Score": 0,
-                "Product Development Reasoning": "Error",
-                "Offline Promotion Score": 0,
-                "Offline Promotion Reasoning": "Error",
-                "Supply Chain/Logistics Score": 0,
-                "Supply Chain/Logistics Reasoning": "Error",
-                "Store Operations Score": 0,
-                "Store Operations Reasoning": "Error",
-                "Overall Score": 0,
-                "Category": startup["Section"],
-                "Industry": startup["Industry Category"]
-            }
-            raw_outputs.append({
+            save_analysis(checkpoint, startup, output, result)
+        raw_outputs[index] = {"company": startup["Company Name"], "raw_output": output}
+        results[index] = result
+        return not parse_failed(result)
+    
+    # A checkpointed reply that turns out not to parse is asked for again
+    pending = []
+    for index, startup in enumerate(startups):
+        record = checkpoint.get(analysis_key(startup))
+        if not is_reusable(record) or not finish(index, record["raw_output"]):
+            pending.append(index)
+    done = len(startups) - len(pending)
+    if on_progress and startups:
+        on_progress(done, len(startups))
+    
+    analyses = iter_concurrent(
+        lambda index: request_analysis(startups[index], trace=trace, checkpoint=checkpoint),
+        pending, concurrency)
+    for position, output, error in analyses:
+        index = pending[position]
+        startup = startups[index]
+        if error is None:
+            finish(index, output)
+        else:
+            st.error(f"OpenAI API Error for {startup['Company Name']}: {str(error)}")
+            raw_outputs[index] = {
                 "company": startup["Company Name"],
-                "raw_output": f"Error: {str(e)}"
-            })
-            results.append(result)
-        time.sleep(10)
+                "raw_output": f"Error: {str(error)}"
+            }
+            results[index] = failed_result(startup)
+        done += 1
+        if on_progress:
+            on_progress(done, len(startups))
     
     with open(output_file, "w") as f:
         json.dump(raw_outputs, f, indent=2)
     
     return results
 
+# Write every startup not yet in the checkpoint to a batch request file and
+# submit it through backend. Returns the job directory; the job records all
+# startups so collect_batch_analysis can rebuild the full result list.
+def submit_batch_analysis(startups: List[Dict], backend, checkpoint: AnalysisCheckpoint = None) -> str:
+    if checkpoint is None:
+        checkpoint = AnalysisCheckpoint(ANALYSIS_CHECKPOINT_PATH)
+    requests = {}
+    for startup in startups:
+        key = analysis_key(startup)
+        if not is_reusable(checkpoint.get(key)) and key not in requests:
+            requests[key] = analysis_batch.chat_request(key, analysis_request_body(build_prompt(startup)))
+    return analysis_batch.create_job(ANALYSIS_BATCH_DIR, backend, list(requests.values()), model=ANALYSIS_MODEL,
+                                     prompt_version=PROMPT_VERSION, startups=startups)
+
+# Results of a finished batch job in the order of its startups, parsed with
+# parse_gpt_output and saved to the checkpoint like direct analyses. Also
+# writes results.xlsx into the job directory.
+def collect_batch_analysis(job_dir: str, backend, checkpoint: AnalysisCheckpoint = None) -> List[Dict]:
+    if checkpoint is None:
+        checkpoint = AnalysisCheckpoint(ANALYSIS_CHECKPOINT_PATH)
+    job = analysis_batch.load_job(job_dir)
+    outputs = analysis_batch.fetch_job_output(backend, job_dir, job)
+    results = []
+    for startup in job["startups"]:
+        key = analysis_key(startup)
+        record = checkpoint.get(key)
+        output = outputs.get(key)
+        if is_reusable(record) and "result" in record:
+            results.append(record["result"])
+        elif is_reusable(record):
+            result = parse_gpt_output(record["raw_output"], startup)
+            save_analysis(checkpoint, startup, record["raw_output"], result)
+            results.append(result)
+        elif output is not None and output["error"] is None:
+            instrumentation.record_usage("startup analysis batch", ANALYSIS_MODEL, output["usage"],
+                                         price_factor=analysis_batch.BATCH_PRICE_FACTOR)
+            raw_output = fence_output(output["content"])
+            result = parse_gpt_output(raw_output, startup)
+            save_analysis(checkpoint, startup, raw_output, result)
+            results.append(result)
+        else:
+            error = output["error"] if output else "no output in batch"
+            st.error(f"Batch request failed for {startup['Company Name']}: {error}")
+            results.append(failed_result(startup))
+    with open(os.path.join(job_dir, "results.xlsx"), "wb") as f:
+        f.write(results_to_excel(results))
+    return results
+
 # Parse GPT Output
 def parse_gpt_output(output: str, startup: Dict) -> Dict:
     result = {
@@ -222,7 +343,7 @@ def parse_gpt_output(output: str, startup: Dict) -> Dict:
     
     if not output.startswith("```") or not output.endswith("```"):
         st.warning(f"GPT output for {startup['Company Name']} missing ``` markers or not in JSON format")
-        result["Summary"] = "Parsing failed - incorrect format"
+        result["Summary"] = f"{PARSE_FAILED_PREFIX} - incorrect format"
         return result
     
     json_str = output.strip("```").strip()
@@ -243,12 +364,12 @@ def parse_gpt_output(output: str, startup: Dict) -> Dict:
         
         if result["Company"] != startup["Company Name"]:
             st.warning(f"Company name mismatch for {startup['Company Name']}: {result['Company']}")
-            result["Summary"] = "Parsing failed - company name mismatch"
+            result["Summary"] = f"{PARSE_FAILED_PREFIX} - company name mismatch"
             return result
         
     except Exception as e:
         st.warning(f"JSON parsing error for {startup['Company Name']}: {str(e)}")
-        result["Summary"] = f"Parsing failed - {str(e)}"
+        result["Summary"] = f"{PARSE_FAILED_PREFIX} - {str(e)}"
         return result
     
     return result
@@ -302,15 +423,34 @@ def main():
         
         try:
             # Extract startups from PDF
-            startups = extract_startups_from_document("temp.pdf")
+            with instrumentation.span("pdf_extract"):
+                startups = extract_startups_from_document("temp.pdf")
             st.write(f"Extracted {len(startups)} startups from the PDF (filtered to checklist).")
             with st.expander("Extracted Startups (Debug)"):
                 for startup in startups:
                     st.write(f"Name: {startup['Company Name']}, Description: {startup['Description']}")
             
+            if st.button("Submit as Batch Job", help="Half the cost of Analyze Startups; results arrive within 24 hours"):
+                job_dir = submit_batch_analysis(startups, analysis_batch.make_backend(ANALYSIS_BATCH_BACKEND, client))
+                job = analysis_batch.load_job(job_dir)
+                st.success(f"Submitted {job['requests']} startups as batch job {os.path.basename(job_dir)}. "
+                           "Collect the results under Batch Jobs below once it completes.")
+            
             if st.button("Analyze Startups"):
-                with st.spinner("Analyzing startups with GPT..."):
-                    results = analyze_with_gpt(startups, output_file="raw_gpt_outputs.json")
+                checkpoint = AnalysisCheckpoint(ANALYSIS_CHECKPOINT_PATH)
+                reused = sum(is_reusable(checkpoint.get(analysis_key(startup))) for startup in startups)
+                if reused:
+                    st.info(f"{reused} of {len(startups)} startups were already analyzed and will not be sent again.")
+                progress = st.progress(0.0, text="Analyzing startups with GPT...")
+                with instrumentation.span("analysis_run", startups=len(startups), reused=reused,
+                                          concurrency=ANALYSIS_CONCURRENCY):
+                    results = analyze_with_gpt(
+                        startups,
+                        output_file="raw_gpt_outputs.json",
+                        on_progress=lambda done, total: progress.progress(
+                            done / total, text=f"Analyzed {done}/{total} startups"),
+                        checkpoint=checkpoint
+                    )
                 
                 st.subheader("Analysis Results")
                 results_df = pd.DataFrame([{
@@ -349,6 +489,34 @@ def main():
         
         except Exception as e:
             st.error(f"Error processing PDF: {str(e)}")
+    
+    # Batch jobs are only polled when asked, so the page stays fast
+    job_dirs = analysis_batch.list_jobs(ANALYSIS_BATCH_DIR)
+    if job_dirs:
+        st.subheader("Batch Jobs")
+        for job_dir in job_dirs[:10]:
+            job = analysis_batch.load_job(job_dir)
+            name = os.path.basename(job_dir)
+            with st.expander(f"{name}: {len(job['startups'])} startups, {job['requests']} sent "
+                             f"({job['backend']}, submitted {job['submitted_at']})"):
+                results_path = os.path.join(job_dir, "results.xlsx")
+                if not os.path.exists(results_path) and st.button("Check status and collect", key=f"collect_{name}"):
+                    backend = analysis_batch.make_backend(job["backend"], client)
+                    status = analysis_batch.job_status(backend, job)
+                    st.write(f"Status: {status['status']} ({status['completed']} completed, "
+                             f"{status['failed']} failed of {status['total']})")
+                    if status["status"] in analysis_batch.FINISHED_STATUSES:
+                        with st.spinner("Parsing batch results..."):
+                            collect_batch_analysis(job_dir, backend)
+                if os.path.exists(results_path):
+                    with open(results_path, "rb") as f:
+                        st.download_button(
+                            label="Download Batch Results as Excel",
+                            data=f.read(),
+                            file_name=f"CMU_Startup_Analysis_{name}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            key=f"download_{name}"
+                        )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_BUSY_TIMEOUT_MS = 10000
+# Compiled statements kept per connection; the knowledge base issues a small
+# fixed set of queries, so they are parsed once per thread
+STATEMENT_CACHE_SIZE = 256
+
+
+# Access to one SQLite file from many threads. Each thread gets its own
+# connection, opened in WAL mode so readers see the last committed state and
+# never wait for a writer. Writes go through transaction(), which serialises
+# writers in this process and takes SQLite's write lock up front (BEGIN
+# IMMEDIATE) so a transaction never fails half-way with "database is locked".
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # WAL is a property of the file, so setting it once is enough
+        with self._write_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self):
+        # Autocommit mode: reads are not wrapped in implicit transactions that
+        # would pin an old snapshot, and writes are explicit in transaction()
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                               check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    # This thread's connection, opened on first use
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            self._local.depth = 0
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    # Write transaction on this thread's connection. Nested calls on the same
+    # thread join the outer transaction, which commits once at the end.
+    @contextmanager
+    def transaction(self):
+        conn = self.conn
+        with self._write_lock:
+            if self._local.depth:
+                self._local.depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._local.depth -= 1
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._local.depth = 0
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
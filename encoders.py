@@ -0,0 +1,227 @@
+"""Sentence encoder backends for the knowledge base.
+
+`torch` (default) runs the sentence-transformers model as before. `onnx-int8`
+runs the same transformer exported to ONNX with dynamic int8 quantization on
+onnxruntime, batching texts of similar token length together so little time
+is spent on padding. Select it with EMBEDDING_BACKEND=onnx-int8 after
+exporting once:
+
+    python encoders.py export     # export, quantize and check agreement
+    python encoders.py verify     # re-check agreement and speed
+
+The export records the cosine agreement with the reference model on a fixed
+sample. The int8 backend is only used when the worst agreement is at least
+EMBEDDING_MIN_AGREEMENT; otherwise the app falls back to torch with a warning.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from knowledge_base import EMBEDDING_BATCH_SIZE, MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('torch', 'onnx-int8')
+ENCODER_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join("models", f"{MODEL_NAME}-onnx-int8"))
+MIN_AGREEMENT = float(os.getenv("EMBEDDING_MIN_AGREEMENT", "0.99"))
+ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # 0 lets onnxruntime decide
+AGREEMENT_FILE = "agreement.json"
+
+# Fixed sample for agreement checks: short and long, English and Thai, in the
+# style of the documents and questions the app sees
+AGREEMENT_SAMPLE = [
+    "What are the latest trends in convenience store retail in Thailand?",
+    "How can CJ Express improve category management for snacks and beverages?",
+    "Customers aged 18-35 increasingly pay with mobile wallets and expect app-based loyalty points.",
+    "SKU 8851234 was out of stock in 12 Bangkok stores last week.",
+    "Supply chain disruptions raised logistics costs by eight percent in the second quarter.",
+    "Ready-to-eat meals and fresh food drive repeat visits to neighbourhood stores.",
+    "In-store promotions for private-label products lifted basket size by 5%.",
+    "Store operations teams are piloting electronic shelf labels and automated replenishment.",
+    "แนวโน้มร้านสะดวกซื้อในประเทศไทยปี 2025",
+    "ลูกค้าต้องการสินค้าราคาประหยัดและโปรโมชั่นที่คุ้มค่า",
+    "ระบบโลจิสติกส์และคลังสินค้าช่วยลดต้นทุนการขนส่ง",
+    "ร้านค้าปลีกขนาดเล็กในต่างจังหวัดเติบโตอย่างรวดเร็ว",
+    ("The report reviews competitive positioning against 7-Eleven, Lotus's and Big C, covering store formats, "
+     "pricing strategy, membership programmes and the growth of delivery platforms in urban areas. ") * 3,
+    ("รายงานฉบับนี้วิเคราะห์พฤติกรรมผู้บริโภค การเลือกซื้อสินค้า และผลกระทบของเศรษฐกิจต่อยอดขายของร้านค้าปลีก "
+     "รวมถึงกลยุทธ์การตลาดและการบริหารสินค้าคงคลัง ") * 3,
+]
+
+
+# Text used to key the embedding cache: vectors from different backends
+# differ slightly, so they must not be served for one another
+def embedding_model_id(backend=ENCODER_BACKEND):
+    return MODEL_NAME if backend == 'torch' else f"{MODEL_NAME}:{backend}"
+
+
+def mean_pool(token_embeddings, attention_mask):
+    mask = attention_mask[..., None].astype(token_embeddings.dtype)
+    return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+# Int8 ONNX transformer plus the model's mean pooling. Texts are sorted by
+# token count and cut into batches of batch_size, each padded only to its own
+# longest text, then returned in input order.
+class OnnxEncoder:
+    def __init__(self, model_dir=ONNX_DIR, batch_size=EMBEDDING_BATCH_SIZE, threads=ONNX_THREADS):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model.int8.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.batch_size = batch_size
+        self.max_length = self.config["max_seq_length"]
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        batch_size = batch_size or self.batch_size
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.empty((0, self.config["dimension"]), dtype='float32')
+        lengths = [len(ids) for ids in self.tokenizer(list(texts), truncation=True,
+                                                      max_length=self.max_length)["input_ids"]]
+        order = np.argsort(lengths, kind='stable')
+        out = np.empty((len(texts), self.config["dimension"]), dtype='float32')
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[i] for i in batch], padding='longest', truncation=True,
+                                     max_length=self.max_length, return_tensors='np')
+            attention_mask = encoded["attention_mask"].astype('int64')
+            token_embeddings = self.session.run(None, {
+                "input_ids": encoded["input_ids"].astype('int64'),
+                "attention_mask": attention_mask,
+            })[0]
+            out[batch] = mean_pool(token_embeddings, attention_mask)
+        return out
+
+
+# Export the transformer of the sentence-transformers model to ONNX, quantize
+# its weights to int8 and save the tokenizer next to it
+def export_onnx(out_dir=ONNX_DIR, model_name=MODEL_NAME):
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name, device='cpu')
+    pooling = reference[1].get_config_dict()
+    if not pooling.get("pooling_mode_mean_tokens") or len(reference) > 2:
+        raise ValueError(f"{model_name} does not use plain mean pooling; only that is supported")
+    transformer = reference[0].auto_model.eval()
+
+    class Transformer(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    fp32_path = os.path.join(out_dir, "model.fp32.onnx")
+    sample = reference.tokenizer(["export sample", "a longer export sample text"], padding=True,
+                                 return_tensors='pt')
+    dynamic = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        Transformer(transformer), (sample["input_ids"], sample["attention_mask"]), fp32_path,
+        input_names=["input_ids", "attention_mask"], output_names=["token_embeddings"],
+        dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "token_embeddings": dynamic},
+        opset_version=14,
+    )
+    quantize_dynamic(fp32_path, os.path.join(out_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    reference.tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "config.json"), "w") as f:
+        json.dump({"model_name": model_name, "max_seq_length": reference.max_seq_length,
+                   "dimension": reference.get_sentence_embedding_dimension()}, f, indent=2)
+    return reference
+
+
+# Cosine similarity between reference and candidate embeddings of the same
+# texts, and the throughput of each on them
+def check_agreement(reference, candidate, texts=AGREEMENT_SAMPLE, repeat=8):
+    texts = list(texts) * repeat
+    timings = {}
+    vectors = {}
+    for name, encoder in (("reference", reference), ("candidate", candidate)):
+        encoder.encode(texts[:4])  # warm-up
+        start = time.perf_counter()
+        vectors[name] = np.asarray(encoder.encode(texts), dtype='float32')
+        timings[name] = len(texts) / (time.perf_counter() - start)
+    a = vectors["reference"] / np.linalg.norm(vectors["reference"], axis=1, keepdims=True)
+    b = vectors["candidate"] / np.linalg.norm(vectors["candidate"], axis=1, keepdims=True)
+    cosine = (a * b).sum(axis=1)
+    return {
+        "texts": len(AGREEMENT_SAMPLE),
+        "cosine_min": float(cosine.min()),
+        "cosine_mean": float(cosine.mean()),
+        "reference_texts_per_second": timings["reference"],
+        "candidate_texts_per_second": timings["candidate"],
+        "speedup": timings["candidate"] / timings["reference"],
+    }
+
+
+def saved_agreement(model_dir=ONNX_DIR):
+    path = os.path.join(model_dir, AGREEMENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Encoder for the configured backend, plus the id that keys its embedding
+# cache. The int8 backend is used only if it was exported and its recorded
+# agreement passes MIN_AGREEMENT.
+def load_encoder(backend=ENCODER_BACKEND):
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {', '.join(ENCODER_BACKENDS)}")
+    if backend == 'onnx-int8':
+        agreement = saved_agreement()
+        if agreement is None:
+            logger.warning("No ONNX export in %s; run `python encoders.py export`. Using torch.", ONNX_DIR)
+        elif agreement["cosine_min"] < MIN_AGREEMENT:
+            logger.warning("ONNX int8 agreement %.4f is below %.4f. Using torch.",
+                           agreement["cosine_min"], MIN_AGREEMENT)
+        else:
+            logger.info("Using ONNX int8 encoder (min cosine %.4f, %.1fx faster)",
+                        agreement["cosine_min"], agreement["speedup"])
+            return OnnxEncoder(), embedding_model_id(backend)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME), embedding_model_id('torch')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "verify"])
+    parser.add_argument("--out", default=ONNX_DIR, help="directory for the exported model")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        reference = export_onnx(args.out)
+    else:
+        from sentence_transformers import SentenceTransformer
+        reference = SentenceTransformer(MODEL_NAME, device='cpu')
+    result = check_agreement(reference, OnnxEncoder(args.out, batch_size=args.batch_size))
+    with open(os.path.join(args.out, AGREEMENT_FILE), "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    if result["cosine_min"] < MIN_AGREEMENT:
+        print(f"Minimum cosine {result['cosine_min']:.4f} is below EMBEDDING_MIN_AGREEMENT={MIN_AGREEMENT}; "
+              "the app will keep using torch.")
+
+
+if __name__ == "__main__":
+    main()
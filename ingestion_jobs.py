@@ -0,0 +1,244 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+UPLOAD_DIR = 'data'
+ACTIVE_STATUSES = ('queued', 'running')
+# A queue refreshes the heartbeat of the jobs it owns every
+# JOB_HEARTBEAT_SECONDS; a job whose heartbeat is older than
+# JOB_STALE_SECONDS, or whose owning process is gone, is taken over
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "30"))
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def init_jobs_schema(db):
+    with db.transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, file_name TEXT NOT NULL, file_path TEXT NOT NULL,
+                         file_type TEXT NOT NULL, status TEXT NOT NULL, submitted_at TEXT NOT NULL,
+                         started_at TEXT, finished_at TEXT, duration_seconds REAL, pages_done INTEGER DEFAULT 0,
+                         pages_total INTEGER, chunk_count INTEGER, file_id INTEGER, error TEXT)''')
+        # owner and heartbeat were added later; older databases gain them here
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if 'owner' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if 'heartbeat' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+
+# "host:pid:token" of a queue; the token tells apart two queues of one process
+def _owner_token():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Whether the queue that owns a job may still run it: a process on this host
+# is checked directly, any other owner by the age of its heartbeat
+def _owner_alive(owner, heartbeat):
+    if owner is None or heartbeat is None or time.time() - heartbeat > JOB_STALE_SECONDS:
+        return False
+    host, pid, _ = owner.rsplit(':', 2)
+    return host != socket.gethostname() or _pid_running(int(pid))
+
+
+# Background ingestion for uploaded files. Jobs are recorded in the jobs table
+# of context.db (queued -> running -> done/failed) and run on a small thread
+# pool, so an upload returns immediately and several files ingest in parallel
+# while queries keep being served. Each job records the queue that owns it and
+# a heartbeat; jobs whose owner has died (a restart, a crashed server) are
+# requeued by a live queue, while those of other live queues are left alone.
+class IngestionQueue:
+    def __init__(self, kb, max_workers=INGESTION_WORKERS):
+        self.kb = kb
+        self.db = kb.db
+        self.owner = _owner_token()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._closed = threading.Event()
+        init_jobs_schema(self.db)
+        self._resume_interrupted()
+        threading.Thread(target=self._heartbeat_loop, name="ingest-heartbeat", daemon=True).start()
+
+    # Jobs started after this use kb; the knowledge base must share this
+    # queue's Database. Jobs already running finish on the one they began with.
+    def set_knowledge_base(self, kb):
+        if kb.db is not self.db:
+            raise ValueError("The knowledge base must use the ingestion queue's database")
+        self.kb = kb
+
+    def _execute(self, sql, params=()):
+        with self.db.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def submit(self, file_name, file_path, file_type):
+        cursor = self._execute(
+            "INSERT INTO jobs (file_name, file_path, file_type, status, submitted_at, owner, heartbeat) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (file_name, file_path, file_type, _now(), self.owner, time.time())
+        )
+        job_id = cursor.lastrowid
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    # Save uploaded bytes under data/ and queue them for ingestion. Each upload
+    # gets its own file, prefixed with a random token, so a second upload of
+    # the same name cannot overwrite the first before its job has read it; the
+    # job keeps the plain name for display.
+    def submit_upload(self, file_name, data, file_type):
+        file_name = os.path.basename(file_name)
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex[:12]}_{file_name}")
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return self.submit(file_name, file_path, file_type)
+
+    # A job left queued or running by a queue that is gone is claimed and
+    # started again. The claim only succeeds if the owner is still the one
+    # seen, so two live queues never both take a job. Any partially ingested
+    # file from the interrupted attempt is removed before the job reruns.
+    def _resume_interrupted(self):
+        rows = self.db.query(
+            f"SELECT id, file_id, owner, heartbeat FROM jobs WHERE status IN "
+            f"({','.join('?' * len(ACTIVE_STATUSES))}) AND owner IS NOT ? ORDER BY id",
+            (*ACTIVE_STATUSES, self.owner)
+        )
+        for job_id, file_id, owner, heartbeat in rows:
+            if _owner_alive(owner, heartbeat):
+                continue
+            claimed = self._execute(
+                f"UPDATE jobs SET status='queued', pages_done=0, started_at=NULL, owner=?, heartbeat=? "
+                f"WHERE id=? AND owner IS ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                (self.owner, time.time(), job_id, owner, *ACTIVE_STATUSES)).rowcount
+            if not claimed:
+                continue
+            # file_id stays on the job until _run replaces it, so if this
+            # process dies here the next owner removes the file instead
+            if file_id is not None:
+                self.kb.delete_document(file_id)
+            self.executor.submit(self._run, job_id)
+
+    # Refresh the heartbeat of owned jobs and pick up jobs orphaned since
+    # start-up. After shutdown() it keeps beating until owned jobs finish.
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                beating = self._execute(
+                    f"UPDATE jobs SET heartbeat=? WHERE owner=? AND status IN "
+                    f"({','.join('?' * len(ACTIVE_STATUSES))})",
+                    (time.time(), self.owner, *ACTIVE_STATUSES)).rowcount
+                if self._closed.is_set():
+                    if not beating:
+                        return
+                else:
+                    self._resume_interrupted()
+            except Exception as e:
+                # A busy or briefly unavailable database must not stop the beat
+                logger.warning("ingestion heartbeat failed: %s", e)
+
+    def _run(self, job_id):
+        file_name, file_path, file_type = self.db.query(
+            "SELECT file_name, file_path, file_type FROM jobs WHERE id=?", (job_id,)
+        )[0]
+        kb = self.kb
+        started = datetime.now()
+        file_id = None
+        try:
+            # Link the file row to the job atomically so a restart can clean it
+            # up, unless another queue has taken the job over in the meantime
+            with self.db.transaction():
+                if not self._execute(
+                        "UPDATE jobs SET status='running', started_at=?, heartbeat=? "
+                        "WHERE id=? AND owner=? AND status='queued'",
+                        (started.strftime('%Y-%m-%d %H:%M:%S'), time.time(), job_id, self.owner)).rowcount:
+                    return
+                file_id = kb.create_file(file_name)
+                self._execute("UPDATE jobs SET file_id=? WHERE id=?", (file_id, job_id))
+
+            def progress(pages_done, pages_total):
+                self._execute("UPDATE jobs SET pages_done=?, pages_total=? WHERE id=?",
+                              (pages_done, pages_total, job_id))
+
+            chunk_count = kb.ingest_file(file_path, file_name, file_type, progress, file_id=file_id)
+            self._execute(
+                "UPDATE jobs SET status='done', finished_at=?, duration_seconds=?, chunk_count=? WHERE id=?",
+                (_now(), (datetime.now() - started).total_seconds(), chunk_count, job_id))
+        except Exception as e:
+            if file_id is not None:
+                kb.delete_document(file_id)
+            # An upload that could not be ingested is not kept in data/
+            if os.path.dirname(file_path) == UPLOAD_DIR and os.path.exists(file_path):
+                os.remove(file_path)
+            self._execute(
+                "UPDATE jobs SET status='failed', finished_at=?, duration_seconds=?, file_id=NULL, error=? WHERE id=?",
+                (_now(), (datetime.now() - started).total_seconds(), str(e), job_id))
+
+    # Where the uploaded bytes of a knowledge-base file are kept: the path its
+    # job saved them under, or data/<name> for files stored before uploads
+    # had paths of their own. None for documents added from a path rather
+    # than uploaded, such as the initial context file.
+    def upload_path(self, file_id, name):
+        rows = self.db.query("SELECT file_path FROM jobs WHERE file_id=? ORDER BY id DESC LIMIT 1", (file_id,))
+        if rows:
+            return rows[0][0]
+        return os.path.join(UPLOAD_DIR, name) if os.path.basename(name) == name else None
+
+    # Remove a file from the knowledge base together with its upload in
+    # data/. Every delete path (the app and the HTTP API) goes through here.
+    # Returns the number of chunks removed.
+    def delete_file(self, file_id):
+        rows = self.db.query("SELECT name FROM files WHERE id=?", (file_id,))
+        file_path = self.upload_path(file_id, rows[0][0]) if rows else None
+        chunk_count = self.kb.delete_document(file_id)
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+        return chunk_count
+
+    def list_jobs(self, limit=20):
+        cursor = self.db.execute(
+            "SELECT id, file_name, status, submitted_at, started_at, finished_at, duration_seconds, "
+            "pages_done, pages_total, chunk_count, error FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_job(self, job_id):
+        cursor = self.db.execute(
+            "SELECT id, file_name, status, submitted_at, started_at, finished_at, duration_seconds, "
+            "pages_done, pages_total, chunk_count, file_id, error FROM jobs WHERE id=?", (job_id,))
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def has_active_jobs(self):
+        return self.db.query(
+            f"SELECT COUNT(*) FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+            ACTIVE_STATUSES
+        )[0][0] > 0
+
+    # Stop taking work. Queued jobs are cancelled and released (owner NULL) so
+    # any live queue can claim them at once; with wait=True this also waits
+    # for running jobs to finish.
+    def shutdown(self, wait=False):
+        self._closed.set()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        self._execute("UPDATE jobs SET owner=NULL WHERE owner=? AND status='queued'", (self.owner,))
@@ -0,0 +1,146 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Span timings and token usage from every app are appended to one JSON Lines
+# file, read back by the Metrics page of app.py
+METRICS_PATH = os.getenv("METRICS_PATH", "metrics.jsonl")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# USD per million tokens (prompt, completion); models not listed cost 0
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+_app_name = os.getenv("METRICS_APP", "app")
+_trace = contextvars.ContextVar("trace", default=None)
+_write_lock = threading.Lock()
+_file = None
+_collectors = []
+
+
+# Name recorded with every event from this process, e.g. "cj_agent"
+def set_app(name):
+    global _app_name
+    _app_name = name
+
+
+# Open a JSON Lines file for appending. If a crash left the last line without
+# its newline, one is written first so the next record starts on a line of
+# its own instead of being merged into the partial one.
+def open_jsonl_for_append(path):
+    f = open(path, "a", encoding="utf-8")
+    if os.path.getsize(path):
+        with open(path, "rb") as existing:
+            existing.seek(-1, os.SEEK_END)
+            if existing.read(1) != b"\n":
+                f.write("\n")
+    return f
+
+
+def record(event):
+    global _file
+    if not METRICS_ENABLED and not _collectors:
+        return
+    event = {"ts": time.time(), "app": _app_name, **event}
+    with _write_lock:
+        for events in _collectors:
+            events.append(event)
+    if not METRICS_ENABLED:
+        return
+    line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    with _write_lock:
+        if _file is None:
+            _file = open_jsonl_for_append(METRICS_PATH)
+        _file.write(line)
+        _file.flush()
+
+
+# Also append every event recorded, from any thread, to a list while the block
+# runs, whether or not METRICS_ENABLED writes them to the metrics file
+@contextmanager
+def collect():
+    events = []
+    with _write_lock:
+        _collectors.append(events)
+    try:
+        yield events
+    finally:
+        with _write_lock:
+            _collectors.remove(events)
+
+
+def new_trace():
+    return uuid.uuid4().hex[:12]
+
+
+def current_trace():
+    return _trace.get()
+
+
+def record_span(name, seconds, trace=None, **fields):
+    record({"type": "span", "span": name, "trace": trace or _trace.get(), "seconds": seconds, **fields})
+
+
+# Time a stage. Spans opened inside another span on the same thread share its
+# trace id, so one request's stages can be grouped; pass `trace` to join a
+# trace started elsewhere. Extra fields are recorded as given, and `error` is
+# set when the block raises. Code that yields between start and end (a
+# streaming generator) should time itself and call record_span instead.
+@contextmanager
+def span(name, trace=None, **fields):
+    if trace is None:
+        trace = _trace.get() or new_trace()
+    token = _trace.set(trace)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, trace, error=error, **fields)
+        _trace.reset(token)
+
+
+def cost_usd(model, prompt_tokens, completion_tokens):
+    prices = next((price for name, price in sorted(MODEL_PRICES.items(), key=lambda item: -len(item[0]))
+                   if model and model.startswith(name)), (0.0, 0.0))
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+# Token counts from an OpenAI response's usage, given either as the client
+# library's object or as the "usage" dict of a raw JSON response.
+# price_factor scales the cost, e.g. 0.5 for Batch API requests.
+def record_usage(stage, model, usage, trace=None, price_factor=1.0):
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    else:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    record({"type": "usage", "stage": stage, "model": model, "trace": trace or _trace.get(),
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "cost_usd": cost_usd(model, prompt_tokens, completion_tokens) * price_factor})
+
+
+def load_events(path=METRICS_PATH, since=None):
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if since is None or event.get("ts", 0) >= since:
+                events.append(event)
+    return events
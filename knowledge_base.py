@@ -0,0 +1,757 @@
+import codecs
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import faiss
+import numpy as np
+import PyPDF2
+
+from instrumentation import span
+
+MODEL_NAME = 'paraphrase-multilingual-mpnet-base-v2'
+DIMENSION = 768  # Dimension of paraphrase-multilingual-mpnet-base-v2 embeddings
+CHUNK_SIZE = 1000
+EMBED_BATCH_SIZE = 64  # chunks encoded and inserted together during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))  # texts per encoder forward pass
+DB_PATH = 'context.db'
+# The vector index lives next to the SQLite database it mirrors
+INDEX_PATH = os.path.splitext(DB_PATH)[0] + '.faiss'
+INITIAL_CONTEXT_PATH = 'data/initial_context.txt'
+FILE_PREVIEW_CHARS = 500  # characters of each document shown in file listings
+# 768 float16 values take 1.5 KB, so the default bound keeps the cache near 150 MB
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+# Vector index settings. RAG_INDEX_TYPE is one of auto, flat, ivf, ivfpq or hnsw;
+# auto keeps the exact flat index until the corpus reaches ANN_THRESHOLD chunks
+# and then switches to IVF. Use benchmarks/index_recall.py to pick values.
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto")
+ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "50000"))
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+PQ_SUBQUANTIZERS = 48  # 768 / 48 = 16 dimensions per 8-bit code
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+
+# Keyword search: query terms shorter than a trigram cannot be matched, and
+# very common words would match nearly every chunk
+MIN_KEYWORD_LENGTH = 3
+KEYWORD_STOPWORDS = frozenset(
+    "the and for are was were what which who whom whose when where why how with from that this these those "
+    "about into does did can could should would will have has had any all our your their there its not "
+    "but you they them tell give show list please".split())
+# A word character, including the Thai vowel and tone marks (U+0E31,
+# U+0E34-0E3A, U+0E47-0E4E) that \w leaves out; without them Thai words
+# such as มาม่า fall apart into fragments
+WORD_CHARS = "\\w\u0e31\u0e34-\u0e3a\u0e47-\u0e4e"
+KEYWORD_TERM_PATTERN = re.compile(f"[{WORD_CHARS}][{WORD_CHARS}\\-./]*[{WORD_CHARS}]|[{WORD_CHARS}]")
+# Rank constant for reciprocal rank fusion
+RRF_K = 60
+
+
+# Split text into fixed-size chunks, keeping the character offset of each chunk
+def chunk_text(text, chunk_size=CHUNK_SIZE):
+    return [(i, text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+
+
+# Yield the text of each PDF page in turn; PyPDF2 parses pages lazily
+def iter_pdf_pages(reader):
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+# Yield a text file in fixed-size blocks, decoding UTF-8 incrementally so a
+# multi-byte character split across blocks is kept intact
+def iter_text_blocks(file, block_size=1 << 16):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        yield decoder.decode(block)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+# Incremental version of chunk_text(text.replace('\n', ' ').strip()) for text
+# that arrives page by page. Only the current partial chunk and the latest
+# page are held in memory, and the chunks match the one-shot version exactly.
+class StreamingChunker:
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.offset = 0
+        self.started = False
+
+    def feed(self, text):
+        text = text.replace('\n', ' ')
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return []
+            self.started = True
+        self.buffer += text
+        # Trailing whitespace may turn out to end the document, so a chunk is
+        # only emitted once non-whitespace text follows its end
+        content_end = len(self.buffer.rstrip())
+        chunks = []
+        position = 0
+        while position + self.chunk_size <= content_end:
+            chunks.append((self.offset, self.buffer[position:position + self.chunk_size]))
+            position += self.chunk_size
+            self.offset += self.chunk_size
+        self.buffer = self.buffer[position:]
+        return chunks
+
+    def finish(self):
+        rest = self.buffer.rstrip()
+        self.buffer = ''
+        return [(self.offset, rest)] if rest else []
+
+
+# Create the files and chunks tables. Each row of chunks is one vector in the
+# FAISS index, and the row id is used as the vector id.
+def init_schema(db):
+    with db.transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS files
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, upload_date TEXT, content TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chunks
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, file_id INTEGER NOT NULL,
+                         char_offset INTEGER NOT NULL, text TEXT NOT NULL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks (file_id)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache
+                        (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+        return init_keyword_index(conn)
+
+
+# Full-text index over chunks.text, kept in step with the chunks table by
+# triggers so every insert and delete path maintains it. The trigram
+# tokenizer matches substrings, which suits SKUs, store codes and Thai text
+# without word breaks. Returns False when SQLite was built without FTS5.
+def init_keyword_index(conn):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='chunks_fts'").fetchone() is not None
+    try:
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+                        USING fts5(text, content='chunks', content_rowid='id', tokenize='trigram')''')
+    except sqlite3.OperationalError:
+        return False
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                        INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                        INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    END''')
+    if not exists:
+        # Index chunks stored before the keyword index existed
+        conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+    return True
+
+
+# The next n ids of an AUTOINCREMENT table, so rows can be inserted with one
+# executemany and their ids still known. Call inside a write transaction.
+def reserve_ids(conn, table, n):
+    row = conn.execute(
+        f"SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name=?), 0), "
+        f"COALESCE((SELECT MAX(id) FROM {table}), 0))", (table,)
+    ).fetchone()
+    return list(range(row[0] + 1, row[0] + 1 + n))
+
+
+def keyword_terms(query):
+    terms = []
+    for term in KEYWORD_TERM_PATTERN.findall(query):
+        if len(term) >= MIN_KEYWORD_LENGTH and term.lower() not in KEYWORD_STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms
+
+
+# FTS5 query matching any of the terms, each as a quoted phrase so codes such
+# as "CJ-1024" are not parsed as query syntax
+def fts_query(terms):
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+# Reciprocal rank fusion of ranked hit lists: a chunk scores the sum of
+# 1 / (rrf_k + rank) over the lists it appears in. Fields from earlier lists
+# win when a chunk appears in several.
+def fuse_rankings(rankings, k, rrf_k=RRF_K):
+    scores = {}
+    hits = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, 1):
+            scores[hit["chunk_id"]] = scores.get(hit["chunk_id"], 0.0) + 1.0 / (rrf_k + rank)
+            hits[hit["chunk_id"]] = {**hit, **hits.get(hit["chunk_id"], {})}
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [dict(hits[chunk_id], rrf_score=scores[chunk_id]) for chunk_id in best]
+
+
+# Persistent embedding cache keyed by a hash of the model name and chunk text.
+# Vectors are stored as float16 blobs and the least recently used entries are
+# evicted once the table grows past max_entries.
+class EmbeddingCache:
+    def __init__(self, db, model_name, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db = db
+        self.model_name = model_name
+        self.max_entries = max_entries
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys, batch_size=500):
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            for key, blob in self.db.query(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", batch):
+                found[key] = np.frombuffer(blob, dtype='float16').astype('float32')
+        if found:
+            now = time.time()
+            with self.db.transaction() as conn:
+                conn.executemany("UPDATE embedding_cache SET last_used=? WHERE key=?",
+                                 [(now, key) for key in found])
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, vector.astype('float16').tobytes(), now) for key, vector in items]
+            )
+            excess = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN "
+                    "(SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?)", (excess,))
+
+
+# Number of IVF cells for n vectors: about 4 * sqrt(n), with at least 39
+# training points per cell as k-means requires
+def ivf_nlist(n_vectors):
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def min_training_points(kind, n_vectors):
+    if kind == 'ivf':
+        return 39 * ivf_nlist(n_vectors)
+    if kind == 'ivfpq':
+        # Each PQ sub-quantizer also trains 256 centroids
+        return max(39 * ivf_nlist(n_vectors), 39 * 256)
+    return 0
+
+
+# Index type to use for a corpus of n_vectors chunks. IVF variants fall back to
+# flat while there are too few vectors to train them.
+def choose_index_type(n_vectors, configured=None):
+    configured = configured or INDEX_TYPE
+    if configured == 'auto':
+        kind = 'ivf' if n_vectors >= ANN_THRESHOLD else 'flat'
+    elif configured in INDEX_TYPES:
+        kind = configured
+    else:
+        raise ValueError(f"Unknown index type {configured!r}; expected auto or one of {', '.join(INDEX_TYPES)}")
+    if n_vectors < min_training_points(kind, n_vectors):
+        kind = 'flat'
+    return kind
+
+
+# Create an empty index that accepts add_with_ids. Flat and HNSW are wrapped in
+# IndexIDMap2; IVF indexes store the chunk ids natively.
+def new_index(kind='flat', n_vectors=0, nlist=None):
+    if kind == 'flat':
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(DIMENSION))
+    if kind == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(DIMENSION, HNSW_M)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+    nlist = nlist or ivf_nlist(n_vectors)
+    if kind == 'ivf':
+        return faiss.index_factory(DIMENSION, f"IVF{nlist},Flat")
+    if kind == 'ivfpq':
+        return faiss.index_factory(DIMENSION, f"IVF{nlist},PQ{PQ_SUBQUANTIZERS}")
+    raise ValueError(f"Unknown index type {kind!r}")
+
+
+def index_kind(index):
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        return 'hnsw' if isinstance(inner, faiss.IndexHNSW) else 'flat'
+    ivf = faiss.extract_index_ivf(index)
+    return 'ivfpq' if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else 'ivf'
+
+
+# HNSW graphs cannot drop vectors, so deletes rebuild them from cached embeddings
+def supports_removal(index):
+    return index_kind(index) != 'hnsw'
+
+
+def configure_search(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    kind = index_kind(index)
+    if kind in ('ivf', 'ivfpq'):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif kind == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efSearch = ef_search
+
+
+def indexed_ids(index):
+    if index.ntotal == 0:
+        return set()
+    if isinstance(index, faiss.IndexIDMap2):
+        return set(faiss.vector_to_array(index.id_map).tolist())
+    invlists = faiss.extract_index_ivf(index).invlists
+    ids = set()
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids.update(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).tolist())
+    return ids
+
+
+# True when the index type no longer suits the corpus size, or when an IVF
+# index has grown or shrunk far enough from its cell count to need retraining
+def needs_reindex(index, n_vectors, configured=None):
+    kind = index_kind(index)
+    if kind != choose_index_type(n_vectors, configured):
+        return True
+    if kind in ('ivf', 'ivfpq'):
+        nlist = faiss.extract_index_ivf(index).nlist
+        return not (nlist / 2 <= ivf_nlist(n_vectors) <= nlist * 2)
+    return False
+
+
+# One instance is shared by every Streamlit session and rerun. SQLite access
+# goes through a Database, where each thread has its own WAL connection, so
+# reads of chunks, files and the keyword index never wait for an ingestion.
+# `lock` guards only the in-memory FAISS index and is held briefly: writers
+# commit their rows first and take `lock` afterwards, just to add or remove
+# vectors, so searches never wait on a write transaction. `lock` is never
+# taken inside a write transaction. Index rebuilds likewise run without
+# `lock` and only swap the finished index in under it. `version` is bumped on every corpus change for caches
+# derived from the corpus; it starts from a timestamp so it stays unique when
+# the knowledge base is reloaded.
+class KnowledgeBase:
+    def __init__(self, model, db, index_path=INDEX_PATH, model_name=MODEL_NAME):
+        self.model = model
+        self.db = db
+        self.index_path = index_path
+        self.lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self.version = time.time_ns()
+        self._saved_version = self.version
+        self.embedding_cache = EmbeddingCache(db, model_name)
+        self.has_keyword_index = init_schema(db)
+        with self.lock:
+            self._backfill_chunks()
+            self.index = self._load_index()
+            self._index_mtime = self._disk_mtime()
+
+    # Encode chunk texts, only running the model for texts not already cached.
+    # Identical texts are encoded once per call.
+    def encode(self, texts):
+        keys = [self.embedding_cache.key(text) for text in texts]
+        vectors = self.embedding_cache.get_many(list(set(keys)))
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                misses.setdefault(key, text)
+        if misses:
+            encoded = self.encode_query(list(misses.values()))
+            # Round-trip through float16 so a text maps to the same vector
+            # whether it was just encoded or read back from the cache
+            encoded = encoded.astype('float16').astype('float32')
+            new_items = list(zip(misses.keys(), encoded))
+            self.embedding_cache.put_many(new_items)
+            vectors.update(new_items)
+        if not texts:
+            return np.empty((0, DIMENSION), dtype='float32')
+        return np.vstack([vectors[key] for key in keys])
+
+    # Encode without the cache, for one-off texts such as user questions
+    def encode_query(self, texts):
+        with span("embed", texts=len(texts)):
+            return np.asarray(self.model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE), dtype='float32')
+
+    # Chunk any file rows stored before the chunks table existed
+    def _backfill_chunks(self):
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, content FROM files WHERE id NOT IN (SELECT DISTINCT file_id FROM chunks)"
+            ).fetchall()
+            for file_id, content in rows:
+                conn.executemany(
+                    "INSERT INTO chunks (file_id, char_offset, text) VALUES (?, ?, ?)",
+                    [(file_id, offset, chunk) for offset, chunk in chunk_text(content or '')]
+                )
+
+    # Load the saved index and reconcile it with the chunks table. Only chunks
+    # missing from the saved index are encoded, so a clean restart encodes nothing.
+    def _load_index(self):
+        index = None
+        if os.path.exists(self.index_path):
+            try:
+                index = faiss.read_index(self.index_path)
+            except Exception:
+                index = None
+        stored_ids = {row[0] for row in self.db.query("SELECT id FROM chunks")}
+        if index is None or index.d != DIMENSION or needs_reindex(index, len(stored_ids)):
+            index = self._build_index()
+            self._save(index)
+            return index
+
+        present_ids = indexed_ids(index)
+        stale_ids = present_ids - stored_ids
+        missing_ids = sorted(stored_ids - present_ids)
+        if stale_ids and not supports_removal(index):
+            index = self._build_index()
+        else:
+            if stale_ids:
+                index.remove_ids(np.array(sorted(stale_ids), dtype='int64'))
+            if missing_ids:
+                self._add_chunks_to_index(index, missing_ids)
+        configure_search(index)
+
+        if stale_ids or missing_ids or not os.path.exists(self.index_path):
+            self._save(index)
+        return index
+
+    # Build a new index over every stored chunk, training it first if the index
+    # type needs it. Vectors come from the embedding cache where possible.
+    def _build_index(self, kind=None):
+        chunk_ids = [row[0] for row in self.db.query("SELECT id FROM chunks ORDER BY id")]
+        kind = choose_index_type(len(chunk_ids), kind)
+        index = new_index(kind, len(chunk_ids))
+        if not index.is_trained:
+            sample_size = min(len(chunk_ids), 256 * faiss.extract_index_ivf(index).nlist)
+            sample_ids = [row[0] for row in self.db.query(
+                "SELECT id FROM chunks ORDER BY RANDOM() LIMIT ?", (sample_size,))]
+            index.train(self._chunk_vectors(sample_ids))
+        self._add_chunks_to_index(index, chunk_ids)
+        configure_search(index)
+        return index
+
+    def _chunk_vectors(self, chunk_ids, batch_size=256):
+        vectors = []
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.db.query(f"SELECT text FROM chunks WHERE id IN ({placeholders})", batch)
+            vectors.append(self.encode([row[0] for row in rows]))
+        return np.vstack(vectors) if vectors else np.empty((0, DIMENSION), dtype='float32')
+
+    def _add_chunks_to_index(self, index, chunk_ids, batch_size=256):
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.db.query(f"SELECT id, text FROM chunks WHERE id IN ({placeholders}) ORDER BY id", batch)
+            if rows:
+                ids = np.array([row[0] for row in rows], dtype='int64')
+                index.add_with_ids(self.encode([row[1] for row in rows]), ids)
+
+    # Switch index type or retrain once the corpus size calls for it. Must
+    # not be called with `lock` held.
+    def _maybe_reindex(self):
+        with self.lock:
+            if not needs_reindex(self.index, self.index.ntotal):
+                return
+        self._replace_index(if_needed=True)
+
+    # Build a new index without holding `lock`, so searches keep using the
+    # current one, then swap it in. Chunks written or deleted while it was
+    # being built are reconciled with the chunks table under the lock first,
+    # whether their vectors went to the old index or are still to come
+    # (_add_vectors skips those the new index already holds). One rebuild
+    # runs at a time; with if_needed a rebuild that another thread has made
+    # unnecessary is skipped.
+    def _replace_index(self, kind=None, if_needed=False):
+        with self._rebuild_lock:
+            if if_needed:
+                with self.lock:
+                    if not needs_reindex(self.index, self.index.ntotal):
+                        return
+            index = self._build_index(kind)
+            with self.lock:
+                stored_ids = {row[0] for row in self.db.query("SELECT id FROM chunks")}
+                present_ids = indexed_ids(index)
+                stale_ids = present_ids - stored_ids
+                if stale_ids and supports_removal(index):
+                    index.remove_ids(np.array(sorted(stale_ids), dtype='int64'))
+                missing_ids = sorted(stored_ids - present_ids)
+                if missing_ids:
+                    self._add_chunks_to_index(index, missing_ids)
+                self.index = index
+
+    # Write to a temporary file first so a crash never leaves a truncated index
+    def _save(self, index):
+        tmp_path = self.index_path + '.tmp'
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    # The index is serialised under the lock but written to disk outside it,
+    # so searches are not held up by file I/O. A snapshot older than one
+    # already written is skipped.
+    def save_index(self):
+        with span("index_save"):
+            with self.lock:
+                data = faiss.serialize_index(self.index)
+                self.version += 1
+                version = self.version
+            with self._save_lock:
+                if version <= self._saved_version:
+                    return
+                tmp_path = self.index_path + '.tmp'
+                data.tofile(tmp_path)
+                os.replace(tmp_path, self.index_path)
+                self._saved_version = version
+                self._index_mtime = self._disk_mtime()
+
+    def _disk_mtime(self):
+        return os.path.getmtime(self.index_path) if os.path.exists(self.index_path) else None
+
+    # True when another process has rewritten the saved index since we loaded it
+    def is_stale(self):
+        with self._save_lock:
+            return self._disk_mtime() != self._index_mtime
+
+    def has_file(self, name):
+        return self.db.query("SELECT COUNT(*) FROM files WHERE name=?", (name,))[0][0] > 0
+
+    def count_files(self):
+        return self.db.query("SELECT COUNT(*) FROM files")[0][0]
+
+    # One page of file metadata, newest first: (id, name, upload_date,
+    # content_chars, chunk_count, preview). Only the first preview_chars of
+    # each document's content leave SQLite; limit -1 lists every file.
+    def list_files(self, limit=-1, offset=0, preview_chars=FILE_PREVIEW_CHARS):
+        return self.db.query(
+            """SELECT id, name, upload_date, length(content),
+                      (SELECT COUNT(*) FROM chunks WHERE chunks.file_id = files.id),
+                      substr(content, 1, ?)
+               FROM files ORDER BY id DESC LIMIT ? OFFSET ?""",
+            (preview_chars, limit, offset))
+
+    def get_file_content(self, file_id):
+        rows = self.db.query("SELECT content FROM files WHERE id=?", (file_id,))
+        return rows[0][0] if rows else None
+
+    def search(self, query_embeddings, k):
+        with span("index_search", k=k):
+            with self.lock:
+                return self.index.search(np.asarray(query_embeddings, dtype='float32'), k)
+
+    # Fetch chunk rows with one IN (...) query and return them in the order of
+    # chunk_ids, skipping ids that no longer exist
+    def fetch_chunks(self, chunk_ids):
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids if chunk_id >= 0]
+        if not chunk_ids:
+            return []
+        placeholders = ','.join('?' * len(chunk_ids))
+        with span("sqlite_fetch", rows=len(chunk_ids)):
+            rows = self.db.query(
+                f"""SELECT chunks.id, chunks.file_id, files.name, chunks.char_offset, chunks.text
+                    FROM chunks JOIN files ON files.id = chunks.file_id
+                    WHERE chunks.id IN ({placeholders})""",
+                chunk_ids
+            )
+        by_id = {row[0]: row for row in rows}
+        return [
+            {"chunk_id": row[0], "file_id": row[1], "file_name": row[2], "offset": row[3], "text": row[4]}
+            for row in (by_id.get(chunk_id) for chunk_id in chunk_ids) if row
+        ]
+
+    # Nearest chunks for a single query embedding, best match first
+    def retrieve(self, query_embedding, k=10):
+        D, I = self.search(np.asarray(query_embedding, dtype='float32').reshape(1, -1), k)
+        distances = {int(chunk_id): float(distance) for chunk_id, distance in zip(I[0], D[0]) if chunk_id >= 0}
+        hits = self.fetch_chunks(I[0].tolist())
+        for hit in hits:
+            hit["distance"] = distances[hit["chunk_id"]]
+        return hits
+
+    # Chunks matching any keyword in the query, best BM25 score first. Returns
+    # an empty list when the query has no usable terms or FTS5 is unavailable.
+    def keyword_search(self, query, k=10):
+        terms = keyword_terms(query)
+        if not self.has_keyword_index or not terms:
+            return []
+        with span("keyword_search", terms=len(terms)):
+            rows = self.db.query(
+                """SELECT chunks.id, chunks.file_id, files.name, chunks.char_offset, chunks.text, chunks_fts.rank
+                   FROM chunks_fts
+                   JOIN chunks ON chunks.id = chunks_fts.rowid
+                   JOIN files ON files.id = chunks.file_id
+                   WHERE chunks_fts MATCH ? ORDER BY chunks_fts.rank LIMIT ?""",
+                (fts_query(terms), k)
+            )
+        return [
+            {"chunk_id": row[0], "file_id": row[1], "file_name": row[2], "offset": row[3], "text": row[4],
+             "bm25": row[5]}
+            for row in rows
+        ]
+
+    # Vector and keyword hits fused by reciprocal rank. Keyword-only hits carry
+    # no distance.
+    def hybrid_retrieve(self, query, query_embedding, k=10, keyword_hits=None):
+        if keyword_hits is None:
+            keyword_hits = self.keyword_search(query, k)
+        vector_hits = self.retrieve(query_embedding, k)
+        if not keyword_hits:
+            return vector_hits
+        return fuse_rankings([vector_hits, keyword_hits], k)
+
+    # Store a document, its chunks and their vectors, and persist the index
+    def add_document(self, name, text):
+        chunks = chunk_text(text)
+        embeddings = self.encode([chunk for _, chunk in chunks]) if chunks else None
+        index = self.index
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO files (name, upload_date, content) VALUES (?, ?, ?)",
+                (name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), text)
+            )
+            chunk_ids = self._insert_chunks(conn, cursor.lastrowid, chunks)
+        with self.lock:
+            self._add_vectors(index, chunk_ids, embeddings)
+        self._maybe_reindex()
+        self.save_index()
+        return [chunk for _, chunk in chunks]
+
+    # Insert chunk rows with one executemany inside the caller's write
+    # transaction; returns their ids for _add_vectors once it has committed
+    def _insert_chunks(self, conn, file_id, chunks):
+        if not chunks:
+            return []
+        chunk_ids = reserve_ids(conn, 'chunks', len(chunks))
+        conn.executemany(
+            "INSERT INTO chunks (id, file_id, char_offset, text) VALUES (?, ?, ?, ?)",
+            [(chunk_id, file_id, offset, chunk) for chunk_id, (offset, chunk) in zip(chunk_ids, chunks)]
+        )
+        return chunk_ids
+
+    # Add vectors for chunk rows committed while `index` was the live index.
+    # Called with the lock held. If the index has been rebuilt since, the
+    # rebuild read the chunks table and may already hold some of them.
+    def _add_vectors(self, index, chunk_ids, embeddings):
+        if self.index is not index:
+            present = indexed_ids(self.index)
+            keep = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in present]
+            chunk_ids, embeddings = [chunk_ids[i] for i in keep], embeddings[keep]
+        if chunk_ids:
+            self.index.add_with_ids(embeddings, np.array(chunk_ids, dtype='int64'))
+
+    # Streaming ingestion into a row from create_file: pages -> chunks ->
+    # fixed-size embedding batches -> index and DB inserts. Python memory stays
+    # bounded by one page plus one batch, however long the document; the full
+    # text is assembled once, in SQLite, after the last batch.
+    # progress(pages_done, total_pages) is called after each page. On failure
+    # everything stored for the file is removed.
+    def ingest_pages(self, file_id, pages, total_pages=None, progress=None, batch_size=EMBED_BATCH_SIZE):
+        chunker = StreamingChunker()
+        batch = []
+        chunk_count = 0
+        try:
+            for page_number, page_text in enumerate(pages, 1):
+                for chunk in chunker.feed(page_text):
+                    batch.append(chunk)
+                    if len(batch) == batch_size:
+                        self._ingest_batch(file_id, batch)
+                        chunk_count += len(batch)
+                        batch = []
+                if progress:
+                    progress(page_number, total_pages)
+            batch.extend(chunker.finish())
+            if batch:
+                self._ingest_batch(file_id, batch)
+                chunk_count += len(batch)
+            self._store_content(file_id)
+            self._maybe_reindex()
+            self.save_index()
+        except Exception:
+            self.delete_document(file_id)
+            raise
+        return chunk_count
+
+    # Chunks partition the normalised text, so the file's content is their
+    # concatenation in offset order. It is written once, after the last batch,
+    # rather than appended to on every batch.
+    def _store_content(self, file_id):
+        with self.db.transaction() as conn:
+            conn.execute(
+                """UPDATE files SET content = COALESCE(
+                       (SELECT group_concat(text, '') FROM
+                           (SELECT text FROM chunks WHERE file_id=? ORDER BY char_offset)), '')
+                   WHERE id=?""",
+                (file_id, file_id))
+
+    # Register an empty file row for ingest_pages to fill
+    def create_file(self, name):
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO files (name, upload_date, content) VALUES (?, ?, '')",
+                (name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            return cursor.lastrowid
+
+    # Ingest a saved PDF or text file; returns the number of chunks stored
+    def ingest_file(self, path, name, file_type, progress=None, file_id=None):
+        if file_id is None:
+            file_id = self.create_file(name)
+        with open(path, 'rb') as f:
+            if file_type == 'pdf':
+                reader = PyPDF2.PdfReader(f)
+                return self.ingest_pages(file_id, iter_pdf_pages(reader), len(reader.pages), progress)
+            return self.ingest_pages(file_id, iter_text_blocks(f), progress=progress)
+
+    # Encoding happens before any lock is taken; the batch is then written in
+    # one short transaction and its vectors added once that has committed
+    def _ingest_batch(self, file_id, batch):
+        embeddings = self.encode([chunk for _, chunk in batch])
+        index = self.index
+        with span("sqlite_write", rows=len(batch)):
+            with self.db.transaction() as conn:
+                chunk_ids = self._insert_chunks(conn, file_id, batch)
+        with self.lock:
+            self._add_vectors(index, chunk_ids, embeddings)
+
+    # Drop only this file's vectors by their chunk ids; nothing is re-encoded
+    def delete_document(self, file_id):
+        with self.db.transaction() as conn:
+            chunk_ids = [row[0] for row in conn.execute("SELECT id FROM chunks WHERE file_id=?", (file_id,))]
+            conn.execute("DELETE FROM chunks WHERE file_id=?", (file_id,))
+            conn.execute("DELETE FROM files WHERE id=?", (file_id,))
+        if chunk_ids:
+            with self.lock:
+                removable = supports_removal(self.index)
+                if removable:
+                    self.index.remove_ids(np.array(chunk_ids, dtype='int64'))
+            if removable:
+                self._maybe_reindex()
+            else:
+                self._replace_index()
+        self.save_index()
+        return len(chunk_ids)
+
+    # Maintenance action: rebuild (and retrain) the index over every stored
+    # chunk. Embeddings are re-encoded only where the cache has no entry.
+    def rebuild_index(self, kind=None):
+        self._replace_index(kind)
+        self.save_index()
+
+
+# Add the initial context file once; returns False if the file is missing
+def load_initial_context(kb, path=INITIAL_CONTEXT_PATH):
+    if not os.path.exists(path):
+        return False
+    if not kb.has_file(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            kb.add_document(path, f.read())
+    return True
@@ -0,0 +1,113 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+# Rough token count of a prompt, ~4 characters per token. OpenAI counts
+# max_tokens against the tokens-per-minute limit as well, so callers add it.
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+# Requests-per-minute and tokens-per-minute token buckets shared by every
+# worker thread. Each bucket holds up to one minute of capacity and refills
+# continuously; acquire() blocks until both can cover the request.
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.capacity = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for name, capacity in self.capacity.items():
+            self.available[name] = min(capacity, self.available[name] + elapsed * capacity / 60)
+
+    def acquire(self, tokens):
+        # A request larger than a whole minute of tokens waits for a full bucket
+        needed = {"requests": 1.0, "tokens": min(float(tokens), self.capacity["tokens"])}
+        with self.condition:
+            while True:
+                self._refill()
+                wait = max((needed[name] - self.available[name]) * 60 / self.capacity[name]
+                           for name in needed)
+                if wait <= 0:
+                    for name in needed:
+                        self.available[name] -= needed[name]
+                    return
+                self.condition.wait(wait)
+
+    # Return the difference once the real usage is known (negative to charge more)
+    def refund(self, tokens):
+        with self.condition:
+            self._refill()
+            self.available["tokens"] = min(self.capacity["tokens"], self.available["tokens"] + tokens)
+            self.condition.notify_all()
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and status >= 500
+
+
+# Seconds asked for by a 429's Retry-After header, if any
+def retry_after(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Call func(), retrying 429, 5xx and connection errors with exponential
+# backoff and full jitter, or the server's Retry-After when it sends one
+def call_with_backoff(func, max_retries=MAX_RETRIES, base=BACKOFF_BASE_SECONDS, max_delay=BACKOFF_MAX_SECONDS):
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base * 2 ** attempt))
+            logger.warning("OpenAI call failed (%s), retry %d/%d in %.1fs", e, attempt + 1, max_retries, delay)
+            time.sleep(delay)
+
+
+# Run func over items on `concurrency` threads, yielding (index, value, error)
+# on the calling thread as each call finishes, so the caller may save results
+# and update Streamlit widgets between them. If the caller stops early (e.g. a
+# Streamlit rerun), queued calls are cancelled and calls in flight finish in
+# the background.
+def iter_concurrent(func, items, concurrency):
+    def run_one(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="openai")
+    try:
+        futures = {executor.submit(run_one, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
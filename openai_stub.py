@@ -0,0 +1,123 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+Answers every request with a short deterministic reply built from the
+question, after an optional fixed delay, in the same JSON and server-sent
+event formats as the real API (including the usage chunk of a stream). Point
+the apps or rag_service.py at it to test or benchmark without network calls:
+
+    python openai_stub.py --port 8001 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python rag_service.py batch questions.txt
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def stub_answer(messages):
+    question = messages[-1]["content"] if messages else ""
+    if "Question:" in question:
+        question = question.rsplit("Question:", 1)[1]
+    question = " ".join(question.split())[:200]
+    return (f"- Stub answer for: {question}\n"
+            f"- Prompt had {sum(len(message['content']) for message in messages)} characters.")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        time.sleep(self.latency)
+        messages = request.get("messages", [])
+        answer = stub_answer(messages)
+        words = answer.split(" ")
+        if request.get("max_tokens"):
+            words = words[:request["max_tokens"]]
+        answer = " ".join(words)
+        usage = {
+            "prompt_tokens": sum(_estimate_tokens(message["content"]) for message in messages),
+            "completion_tokens": len(words),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunks = [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]
+        chunks += [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}
+                   for i, word in enumerate(words)]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+        for choice in chunks:
+            self._send_event({**base, "object": "chat.completion.chunk", "choices": [choice], "usage": None})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _send_event(self, body):
+        self.wfile.write(b"data: " + json.dumps(body).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+
+def make_stub_server(host="127.0.0.1", port=0, latency=0.0):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# Start the stub on a background thread; port 0 picks a free port. Returns the
+# server (call shutdown() to stop it) and its base URL for OPENAI_BASE_URL.
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0):
+    server = make_stub_server(host, port, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    args = parser.parse_args()
+    server = make_stub_server(args.host, args.port, args.latency)
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,17 @@ import streamlit as st
 import pandas as pd
 import requests
 import json
+import os
+import sys
 from datetime import datetime
 import matplotlib.pyplot as plt
 
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import instrumentation  # noqa: E402
+
+instrumentation.set_app("ma_app")
+
 # Streamlit app title
 st.title("CJ Express M&A Strategic Analysis")
 
@@ -83,8 +91,10 @@ with tab1:
             }
 
             try:
-                response = requests.post(url, headers=headers, json=payload)
+                with instrumentation.span("llm", stage="m&a analysis"):
+                    response = requests.post(url, headers=headers, json=payload)
                 if response.status_code == 200:
+                    instrumentation.record_usage("m&a analysis", payload["model"], response.json().get("usage"))
                     json_response = json.loads(response.json()["choices"][0]["message"]["content"])
                     learnings_strategy_col.append(json.dumps(json_response))
                 else:
@@ -132,8 +142,10 @@ with tab1:
                 "temperature": 0.3
             }
             try:
-                response = requests.post(url, headers=headers, json=payload)
+                with instrumentation.span("llm", stage="m&a chat"):
+                    response = requests.post(url, headers=headers, json=payload)
                 if response.status_code == 200:
+                    instrumentation.record_usage("m&a chat", payload["model"], response.json().get("usage"))
                     answer = response.json()["choices"][0]["message"]["content"]
                     st.write(f"**Answer**: {answer}")
                 else:
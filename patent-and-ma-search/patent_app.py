@@ -2,8 +2,16 @@ import streamlit as st
 import pandas as pd
 import requests
 import json
+import os
+import sys
 from datetime import datetime
 
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import instrumentation  # noqa: E402
+
+instrumentation.set_app("patent_app")
+
 # Streamlit app title and description
 st.title("Patent Relevancy Analysis for CJ Express")
 st.markdown("""
@@ -89,10 +97,12 @@ if uploaded_file and api_key:
         }
 
         # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
+        with instrumentation.span("llm", stage="patent analysis"):
+            response = requests.post(url, headers=headers, json=payload)
 
         # Check if the request was successful
         if response.status_code == 200:
+            instrumentation.record_usage("patent analysis", payload["model"], response.json().get("usage"))
             # Parse JSON response
             json_response = json.loads(response.json()["choices"][0]["message"]["content"])
             results.append(json_response)
@@ -0,0 +1,423 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from instrumentation import new_trace, record_span, record_usage, span
+from knowledge_base import WORD_CHARS
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = "gpt-4o-mini"
+RETRIEVAL_K = int(os.getenv("RAG_RETRIEVAL_K", "10"))
+# Token budget for the retrieved context placed in the prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+MAX_ANSWER_TOKENS = int(os.getenv("RAG_MAX_ANSWER_TOKENS", "1000"))
+# Hits further than MAX_DISTANCE (squared L2), or further than
+# RELATIVE_DISTANCE_CUTOFF times the best hit's distance, are dropped
+MAX_DISTANCE = float(os.getenv("RAG_MAX_DISTANCE")) if os.getenv("RAG_MAX_DISTANCE") else None
+RELATIVE_DISTANCE_CUTOFF = float(os.getenv("RAG_RELATIVE_DISTANCE_CUTOFF", "1.5"))
+# Chunks whose character 5-gram Jaccard similarity to a better-ranked chunk is
+# at least this are treated as duplicates
+DUPLICATE_THRESHOLD = float(os.getenv("RAG_DUPLICATE_THRESHOLD", "0.8"))
+# Questions naming an identifier (a code-like token such as a SKU or store
+# code) that the keyword index finds are answered from keyword hits alone,
+# without embedding the question
+KEYWORD_SHORT_CIRCUIT = os.getenv("RAG_KEYWORD_SHORT_CIRCUIT", "1") != "0"
+# Words, with runs joined by "-" or "." kept whole (CJ-1023, 8850123.01)
+TOKEN_PATTERN = re.compile(f"[{WORD_CHARS}]+(?:[-.][{WORD_CHARS}]+)*")
+
+# Answer cache: a question whose embedding has at least this cosine similarity
+# to a cached question reuses its answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("RAG_ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("RAG_ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+SYSTEM_PROMPT = (
+    "You are an AI assistant for CJ Express, a convenience store chain in Thailand. "
+    "Your task is to provide accurate and insightful answers based on the provided context. "
+    "Follow these steps:\n"
+    "1. Analyze the context carefully to identify relevant information.\n"
+    "2. If the context is insufficient, clearly state that the information is not available and provide a general response based on your knowledge of retail trends.\n"
+    "3. Structure your answer in a clear and concise manner, using bullet points or paragraphs as appropriate.\n"
+    "4. Avoid speculation and focus on the provided context.\n"
+    "5. If the query is ambiguous, ask for clarification or interpret it in the most logical way."
+)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # tokenizer used by gpt-4o-mini
+except Exception:
+    _encoding = None
+
+
+# Exact count with tiktoken when installed, otherwise about 4 characters a token
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Keyword-only hits have no distance and are always kept
+def filter_by_distance(hits, max_distance=MAX_DISTANCE, relative_cutoff=RELATIVE_DISTANCE_CUTOFF):
+    distances = [hit["distance"] for hit in hits if hit.get("distance") is not None]
+    if not distances:
+        return list(hits)
+    best = min(distances)
+    limit = best * relative_cutoff if relative_cutoff and best > 0 else float('inf')
+    if max_distance is not None:
+        limit = min(limit, max_distance)
+    return [hit for hit in hits if hit.get("distance") is None or hit["distance"] <= limit]
+
+
+def _shingles(text, size=5):
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+# Keep the best-ranked copy of any passage that repeats, e.g. the same
+# paragraph in two revisions of a report
+def drop_near_duplicates(hits, threshold=DUPLICATE_THRESHOLD):
+    kept = []
+    kept_shingles = []
+    for hit in hits:
+        shingles = _shingles(hit["text"])
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(hit)
+        kept_shingles.append(shingles)
+    return kept
+
+
+# Join hits that are consecutive chunks of the same file into one passage.
+# A passage takes the rank of its best chunk; best_start is where that chunk
+# begins in the passage text.
+def merge_adjacent(hits):
+    ranked = [dict(hit, rank=rank) for rank, hit in enumerate(hits)]
+    ranked.sort(key=lambda hit: (hit["file_id"], hit["offset"]))
+    passages = []
+    for hit in ranked:
+        previous = passages[-1] if passages else None
+        if (previous and previous["file_id"] == hit["file_id"]
+                and previous["offset"] + len(previous["text"]) == hit["offset"]):
+            if hit["rank"] < previous["rank"]:
+                previous["rank"] = hit["rank"]
+                previous["best_start"] = len(previous["text"])
+            previous["text"] += hit["text"]
+            distances = [d for d in (previous.get("distance"), hit.get("distance")) if d is not None]
+            previous["distance"] = min(distances) if distances else None
+        else:
+            passages.append(dict(hit, best_start=0))
+    passages.sort(key=lambda passage: passage["rank"])
+    return passages
+
+
+# The first (or, from_end, the last) max_tokens tokens of text
+def truncate_tokens(text, max_tokens, from_end=False):
+    if max_tokens <= 0:
+        return ''
+    if _encoding is not None:
+        tokens = _encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return _encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens])
+    chars = max_tokens * 4
+    return text[-chars:] if from_end else text[:chars]
+
+
+# A passage too long for the budget, cut down around its best chunk: the text
+# from that chunk onwards, then as much of what precedes it as still fits
+def trim_passage(passage, token_budget):
+    header = f"[Source: {passage['file_name']}]\n"
+    room = token_budget - count_tokens(header)
+    text, best_start = passage["text"], passage.get("best_start", 0)
+    after = truncate_tokens(text[best_start:], room)
+    before = truncate_tokens(text[:best_start], room - count_tokens(after), from_end=True)
+    block = header + before + after
+    # Token boundaries can shift where the two parts meet
+    return block if count_tokens(block) <= token_budget else header + after
+
+
+# Context assembly: drop distant hits, remove near-duplicates, merge adjacent
+# chunks, then add passages in rank order while they fit the token budget. The
+# top-ranked passage always goes in, trimmed if it alone exceeds the budget,
+# so the prompt never goes out without context when there were hits.
+def pack_context(hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    passages = merge_adjacent(drop_near_duplicates(filter_by_distance(hits)))
+    blocks = []
+    used_tokens = 0
+    for passage in passages:
+        block = f"[Source: {passage['file_name']}]\n{passage['text']}"
+        tokens = count_tokens(block)
+        if used_tokens + tokens > token_budget:
+            if blocks:
+                continue
+            block = trim_passage(passage, token_budget)
+            tokens = count_tokens(block)
+            if tokens > token_budget:
+                continue
+        blocks.append(block)
+        used_tokens += tokens
+    return "\n\n".join(blocks), used_tokens, len(blocks)
+
+
+def _normalize_question(query):
+    return re.sub(r'\s+', ' ', query.strip().lower())
+
+
+# Semantic cache of answers keyed on the question embedding. Entries expire
+# after ttl_seconds, the least recently used entry is evicted beyond
+# max_entries, and everything is dropped when the corpus version changes.
+class AnswerCache:
+    def __init__(self, similarity_threshold=ANSWER_CACHE_SIMILARITY, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # normalized question -> (unit embedding, answer, created_at)
+        self.corpus_version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _sync(self, corpus_version):
+        if corpus_version != self.corpus_version:
+            self.entries.clear()
+            self.corpus_version = corpus_version
+        expired_before = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self.entries.items() if entry[2] < expired_before]:
+            del self.entries[key]
+
+    # Cached answer for an identical or near-identical question, else None.
+    # Without an embedding only identical questions (ignoring case and
+    # spacing) can match. record_miss=False is for a first exact-text check
+    # that will be followed by a full lookup.
+    def get(self, query, corpus_version, embedding=None, record_miss=True):
+        key = _normalize_question(query)
+        with self.lock:
+            self._sync(corpus_version)
+            keys = [k for k, entry in self.entries.items() if entry[0] is not None]
+            if key not in self.entries and embedding is not None and keys:
+                vectors = np.vstack([self.entries[k][0] for k in keys])
+                similarities = vectors @ _unit(embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = keys[best]
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][1]
+            if record_miss:
+                self.misses += 1
+            return None
+
+    # An entry stored without an embedding is only found by identical questions
+    def put(self, query, corpus_version, embedding, answer):
+        with self.lock:
+            self._sync(corpus_version)
+            vector = _unit(embedding) if embedding is not None else None
+            self.entries[_normalize_question(query)] = (vector, answer, time.time())
+            self.entries.move_to_end(_normalize_question(query))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype='float32')
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def build_messages(query, context_text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context: {context_text}\n\nQuestion: {query}"}
+    ]
+
+
+def clean_answer(answer):
+    return "\n".join(line.strip() for line in answer.strip().splitlines() if line.strip())
+
+
+# Characters str.splitlines() breaks on
+LINE_BREAKS = frozenset('\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029')
+
+
+# Incremental clean_answer for streamed text: the concatenated output equals
+# clean_answer(''.join(pieces)). Whitespace is held back until it is known
+# not to be at the end of a line, and blank lines are never emitted.
+def clean_stream(pieces):
+    line_has_text = False
+    emitted_any = False
+    pending_space = ''
+    for piece in pieces:
+        out = []
+        for ch in piece:
+            if ch in LINE_BREAKS:
+                line_has_text = False
+                pending_space = ''
+            elif ch.isspace():
+                if line_has_text:
+                    pending_space += ch
+            else:
+                if not line_has_text:
+                    if emitted_any:
+                        out.append('\n')
+                    line_has_text = True
+                else:
+                    out.append(pending_space)
+                pending_space = ''
+                out.append(ch)
+                emitted_any = True
+        if out:
+            yield ''.join(out)
+
+
+# Stream a chat completion as cleaned text pieces, recording token usage once
+# the final chunk arrives and the time to first token and to completion
+def stream_chat(client, messages, max_tokens, temperature=0.7, log_label="chat", trace=None):
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    def deltas():
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                logger.info("%s: prompt_tokens=%s completion_tokens=%s", log_label,
+                            chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                record_usage(log_label, CHAT_MODEL, chunk.usage, trace)
+
+    first_token_seconds = None
+    for piece in clean_stream(deltas()):
+        if first_token_seconds is None:
+            first_token_seconds = time.perf_counter() - start
+        yield piece
+    record_span("llm", time.perf_counter() - start, trace, stage=log_label, stream=True,
+                first_token_seconds=first_token_seconds)
+
+
+def is_identifier(token):
+    if len(token) < 3 or not any(c.isdigit() for c in token):
+        return False
+    # Letters mixed with digits (SKU123, A4-500), or digits joined by "-" or
+    # "." (8850-123); plain numbers such as years or prices are not codes
+    return any(c.isalpha() for c in token) or '-' in token or '.' in token
+
+
+# Identifiers named in the question, lower-cased
+def identifier_terms(query):
+    return {token.lower() for token in TOKEN_PATTERN.findall(query) if is_identifier(token)}
+
+
+# Keyword hits come from SQLite before any embedding work. When the question
+# names an identifier the keyword index found, those hits are the context and
+# the embedding is skipped (None is returned for it); otherwise the question
+# is embedded and vector and keyword hits are fused.
+def retrieve_hits(kb, query, k=RETRIEVAL_K):
+    keyword_hits = kb.keyword_search(query, k)
+    identifiers = identifier_terms(query) if KEYWORD_SHORT_CIRCUIT and keyword_hits else None
+    if identifiers:
+        # Whole tokens only, so "CJ-10" is not found inside "CJ-1023"
+        hit_tokens = set()
+        for hit in keyword_hits:
+            hit_tokens.update(token.lower() for token in TOKEN_PATTERN.findall(hit["text"]))
+        if identifiers & hit_tokens:
+            return None, keyword_hits
+    query_embedding = kb.encode_query([query])[0]
+    return query_embedding, kb.hybrid_retrieve(query, query_embedding, k, keyword_hits=keyword_hits)
+
+
+def build_context(hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    with span("pack_context", hits=len(hits)):
+        context_text, context_tokens, passage_count = pack_context(hits, token_budget)
+    logger.info("rag context: hits=%d keyword_hits=%d passages=%d context_tokens=%d budget=%d",
+                len(hits), sum(1 for hit in hits if "bm25" in hit), passage_count, context_tokens, token_budget)
+    return context_text
+
+
+# Cached answer, or the embedding and packed context for a fresh one
+def _prepare_answer(kb, query, k, token_budget, cache, corpus_version):
+    if cache is not None:
+        cached = cache.get(query, corpus_version, record_miss=False)
+        if cached is not None:
+            return cached, None, None
+    query_embedding, hits = retrieve_hits(kb, query, k)
+    if cache is not None:
+        cached = cache.get(query, corpus_version, query_embedding)
+        if cached is not None:
+            return cached, None, None
+    return None, query_embedding, build_context(hits, token_budget)
+
+
+def answer_query(kb, client, query, k=RETRIEVAL_K, token_budget=CONTEXT_TOKEN_BUDGET,
+                 max_tokens=MAX_ANSWER_TOKENS, cache=None):
+    with span("rag_query"):
+        corpus_version = kb.version
+        cached, query_embedding, context_text = _prepare_answer(kb, query, k, token_budget, cache, corpus_version)
+        if cached is not None:
+            return cached
+
+        with span("llm", stage="rag answer"):
+            response = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=build_messages(query, context_text),
+                max_tokens=max_tokens,
+                temperature=0.7
+            )
+        usage = response.usage
+        if usage:
+            logger.info("rag answer: prompt_tokens=%s completion_tokens=%s",
+                        usage.prompt_tokens, usage.completion_tokens)
+            record_usage("rag answer", CHAT_MODEL, usage)
+        answer = clean_answer(response.choices[0].message.content)
+        if cache is not None:
+            cache.put(query, corpus_version, query_embedding, answer)
+        return answer
+
+
+# Streaming variant of answer_query: yields cleaned answer text as tokens
+# arrive, so the first words show as soon as the model produces them. A
+# cached answer is yielded in one piece; a fresh one is cached only once it
+# has streamed to the end.
+def stream_answer(kb, client, query, k=RETRIEVAL_K, token_budget=CONTEXT_TOKEN_BUDGET,
+                  max_tokens=MAX_ANSWER_TOKENS, cache=None):
+    trace = new_trace()
+    start = time.perf_counter()
+    corpus_version = kb.version
+    with span("retrieval", trace=trace):
+        cached, query_embedding, context_text = _prepare_answer(kb, query, k, token_budget, cache, corpus_version)
+    if cached is not None:
+        record_span("rag_query", time.perf_counter() - start, trace, cached=True)
+        yield cached
+        return
+
+    pieces = []
+    for piece in stream_chat(client, build_messages(query, context_text), max_tokens, log_label="rag answer",
+                             trace=trace):
+        pieces.append(piece)
+        yield piece
+    record_span("rag_query", time.perf_counter() - start, trace, cached=False)
+    if cache is not None:
+        cache.put(query, corpus_version, query_embedding, ''.join(pieces))
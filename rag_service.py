@@ -0,0 +1,287 @@
+"""Headless access to the knowledge base: an async HTTP API and a CLI.
+
+The embedding model, knowledge base and ingestion workers are loaded once per
+process and shared by every request. Blocking work (encoding, FAISS, SQLite,
+the OpenAI call) runs on a thread pool so the event loop keeps accepting
+requests. OPENAI_BASE_URL is honoured, so openai_stub.py can stand in for the
+OpenAI endpoint.
+
+    python rag_service.py serve --port 8080
+    python rag_service.py batch questions.txt --concurrency 8 --output answers.jsonl
+    python rag_service.py ingest report.pdf notes.txt
+
+HTTP endpoints:
+
+    GET    /health
+    POST   /query          {"question": "...", "stream": false}
+    POST   /files          multipart upload, field "file"; returns a job id
+    GET    /files
+    DELETE /files/{id}
+    GET    /jobs
+    GET    /jobs/{id}
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+import instrumentation
+import rag_pipeline
+from database import Database
+from ingestion_jobs import IngestionQueue
+from encoders import load_encoder
+from knowledge_base import DB_PATH, KnowledgeBase, load_initial_context
+
+logger = logging.getLogger(__name__)
+
+SERVICE_THREADS = int(os.getenv("RAG_SERVICE_THREADS", "8"))
+BATCH_CONCURRENCY = int(os.getenv("RAG_BATCH_CONCURRENCY", "4"))
+
+
+def file_type_for(file_name):
+    return 'pdf' if file_name.lower().endswith('.pdf') else 'plain'
+
+
+# Process-wide resources behind the API and CLI. Like the Streamlit app, the
+# knowledge base is reloaded when another process has rewritten the index.
+class RagService:
+    def __init__(self, api_key=None, base_url=None, threads=SERVICE_THREADS):
+        self.encoder, self.model_id = load_encoder()
+        # The OpenAI client reads OPENAI_BASE_URL itself when base_url is None
+        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url)
+        self.answer_cache = rag_pipeline.AnswerCache()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="rag-service")
+        self._reload_lock = threading.Lock()
+        self.db = Database(DB_PATH)
+        self._load()
+        self.ingestion_queue = IngestionQueue(self.kb)
+
+    # The knowledge base is rebuilt on the same Database; the ingestion queue
+    # lives as long as the service and only switches to the new knowledge base
+    def _load(self):
+        self.kb = KnowledgeBase(self.encoder, self.db, model_name=self.model_id)
+        if not load_initial_context(self.kb):
+            logger.warning("Initial context file (data/initial_context.txt) not found")
+
+    def knowledge_base(self):
+        if self.kb.is_stale():
+            with self._reload_lock:
+                if self.kb.is_stale():
+                    self._load()
+                    self.ingestion_queue.set_knowledge_base(self.kb)
+        return self.kb
+
+    def answer(self, question):
+        return rag_pipeline.answer_query(self.knowledge_base(), self.client, question, cache=self.answer_cache)
+
+    def stream_answer(self, question):
+        return rag_pipeline.stream_answer(self.knowledge_base(), self.client, question, cache=self.answer_cache)
+
+    def submit_file(self, file_name, data):
+        self.knowledge_base()
+        return self.ingestion_queue.submit_upload(file_name, data, file_type_for(file_name))
+
+    def list_files(self):
+        return [{"id": file_id, "name": name, "upload_date": upload_date, "characters": characters,
+                 "chunks": chunks}
+                for file_id, name, upload_date, characters, chunks, _ in
+                self.knowledge_base().list_files(preview_chars=0)]
+
+    # Rows, vectors and the stored upload, as the app's Delete button does
+    def delete_file(self, file_id):
+        self.knowledge_base()
+        return self.ingestion_queue.delete_file(file_id)
+
+    def health(self):
+        kb = self.knowledge_base()
+        return {"status": "ok", "vectors": kb.index.ntotal, "corpus_version": kb.version,
+                "answer_cache": self.answer_cache.stats()}
+
+    def shutdown(self):
+        self.ingestion_queue.shutdown()
+        self.executor.shutdown(wait=False)
+
+
+def create_app(service):
+    from aiohttp import web
+
+    async def run(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(service.executor, func, *args)
+
+    async def health(request):
+        return web.json_response(await run(service.health))
+
+    async def query(request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        question = str(body.get("question", "")).strip()
+        if not question:
+            raise web.HTTPBadRequest(text="'question' is required")
+        if not body.get("stream"):
+            start = time.perf_counter()
+            answer = await run(service.answer, question)
+            return web.json_response({"question": question, "answer": answer,
+                                      "seconds": round(time.perf_counter() - start, 3)})
+
+        # Plain-text chunked response, one write per cleaned piece
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        await response.prepare(request)
+        pieces = await run(service.stream_answer, question)
+        while True:
+            piece = await run(next, pieces, None)
+            if piece is None:
+                break
+            await response.write(piece.encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def upload(request):
+        reader = await request.multipart()
+        field = await reader.next()
+        while field is not None and field.name != "file":
+            field = await reader.next()
+        if field is None or not field.filename:
+            raise web.HTTPBadRequest(text="Upload a file in the 'file' field")
+        data = await field.read()
+        job_id = await run(service.submit_file, field.filename, bytes(data))
+        return web.json_response({"job_id": job_id}, status=202)
+
+    async def list_files(request):
+        return web.json_response(await run(service.list_files))
+
+    async def delete_file(request):
+        chunk_count = await run(service.delete_file, int(request.match_info["file_id"]))
+        return web.json_response({"deleted_chunks": chunk_count})
+
+    async def list_jobs(request):
+        limit = int(request.query.get("limit", "20"))
+        return web.json_response(await run(lambda: service.ingestion_queue.list_jobs(limit)))
+
+    async def get_job(request):
+        job = await run(service.ingestion_queue.get_job, int(request.match_info["job_id"]))
+        if job is None:
+            raise web.HTTPNotFound(text="No such job")
+        return web.json_response(job)
+
+    async def on_cleanup(app):
+        service.shutdown()
+
+    app = web.Application(client_max_size=200 * 1024 * 1024)
+    app.add_routes([
+        web.get("/health", health),
+        web.post("/query", query),
+        web.post("/files", upload),
+        web.get("/files", list_files),
+        web.delete(r"/files/{file_id:\d+}", delete_file),
+        web.get("/jobs", list_jobs),
+        web.get(r"/jobs/{job_id:\d+}", get_job),
+    ])
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+# One question per line, or JSON Lines with a "question" field
+def read_questions(path):
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)["question"]
+            questions.append(line)
+    return questions
+
+
+# Answer every question with up to `concurrency` in flight. Results are
+# written as JSON Lines in input order; a failed question records its error
+# and does not stop the batch.
+def run_batch(service, questions, concurrency, output):
+    def answer_one(question):
+        start = time.perf_counter()
+        try:
+            answer, error = service.answer(question), None
+        except Exception as e:
+            answer, error = None, str(e)
+        return {"question": question, "answer": answer, "error": error,
+                "seconds": round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for result in executor.map(answer_one, questions):
+            failures += result["error"] is not None
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    elapsed = time.perf_counter() - start
+    logger.info("batch: %d questions, %d failed, %.1fs (%.2f questions/s)",
+                len(questions), failures, elapsed, len(questions) / elapsed if elapsed else 0.0)
+    return failures
+
+
+def run_ingest(service, paths, poll_seconds=0.5):
+    job_ids = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            job_ids.append(service.submit_file(os.path.basename(path), f.read()))
+    while service.ingestion_queue.has_active_jobs():
+        time.sleep(poll_seconds)
+    failures = 0
+    for job_id in job_ids:
+        job = service.ingestion_queue.get_job(job_id)
+        failures += job["status"] != 'done'
+        print(json.dumps(job, ensure_ascii=False))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the HTTP API")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    batch_parser = commands.add_parser("batch", help="answer questions from a file")
+    batch_parser.add_argument("questions", help="text file with one question per line, or JSON Lines")
+    batch_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    batch_parser.add_argument("--output", help="write JSON Lines here instead of stdout")
+    ingest_parser = commands.add_parser("ingest", help="add files to the knowledge base and wait")
+    ingest_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s",
+                        stream=sys.stderr)
+    load_dotenv()
+    instrumentation.set_app("rag_service")
+    service = RagService()
+
+    if args.command == "serve":
+        from aiohttp import web
+        web.run_app(create_app(service), host=args.host, port=args.port)
+    elif args.command == "batch":
+        questions = read_questions(args.questions)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as output:
+                failures = run_batch(service, questions, args.concurrency, output)
+        else:
+            failures = run_batch(service, questions, args.concurrency, sys.stdout)
+        service.shutdown()
+        sys.exit(1 if failures else 0)
+    else:
+        failures = run_ingest(service, args.paths)
+        service.shutdown()
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
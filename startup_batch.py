@@ -0,0 +1,87 @@
+"""Score CMU startups through a batch job instead of live chat calls.
+
+Builds the same prompts as the "Analyze Startups" button of
+cmu_techtransfer_startup_analysis.py, writes them to a JSONL request file and
+submits it to the OpenAI Batch API (half price, answered within 24 hours) or
+to a local file-based stand-in. Results are parsed with parse_gpt_output,
+saved to the analysis checkpoint and written to Excel with results_to_excel.
+
+    python startup_batch.py submit cmu_spinoffs.pdf
+    python startup_batch.py status batch_jobs/20250101-120000-abc123
+    python startup_batch.py collect batch_jobs/20250101-120000-abc123 --wait --output scores.xlsx
+    python startup_batch.py run cmu_spinoffs.pdf --backend local --output scores.xlsx
+
+Startups already in the checkpoint are not sent again.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import analysis_batch
+import cmu_techtransfer_startup_analysis as analysis
+
+
+def submit(pdf_path, backend):
+    startups = analysis.extract_startups_from_document(pdf_path)
+    job_dir = analysis.submit_batch_analysis(startups, backend)
+    job = analysis_batch.load_job(job_dir)
+    print(f"{job_dir}: {len(startups)} startups, {job['requests']} sent as batch {job['batch_id']}")
+    return job_dir
+
+
+def collect(job_dir, backend, wait, output):
+    job = analysis_batch.load_job(job_dir)
+    if wait:
+        status = analysis_batch.wait_for_job(
+            backend, job, on_status=lambda s: print(f"{s['status']}: {s['completed']}/{s['total']} done, "
+                                                    f"{s['failed']} failed", file=sys.stderr))
+    else:
+        status = analysis_batch.job_status(backend, job)
+    if status["status"] not in analysis_batch.FINISHED_STATUSES:
+        print(f"Batch is still {status['status']}; run again later or pass --wait", file=sys.stderr)
+        return 2
+    results = analysis.collect_batch_analysis(job_dir, backend)
+    if output:
+        shutil.copyfile(os.path.join(job_dir, "results.xlsx"), output)
+    failed = sum(result["Technology"] == "API Failure" for result in results)
+    print(f"{len(results)} startups scored, {failed} failed; results in {output or os.path.join(job_dir, 'results.xlsx')}")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["openai", "local"], default=analysis.ANALYSIS_BATCH_BACKEND,
+                        help="used by submit and run; other commands use the job's own backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="extract startups from a PDF and submit a batch")
+    submit_parser.add_argument("pdf")
+    status_parser = commands.add_parser("status", help="show a job's batch status")
+    status_parser.add_argument("job_dir")
+    collect_parser = commands.add_parser("collect", help="parse a finished job's results into Excel")
+    collect_parser.add_argument("job_dir")
+    collect_parser.add_argument("--wait", action="store_true", help="poll until the batch finishes")
+    collect_parser.add_argument("--output", help="also copy the Excel results here")
+    run_parser = commands.add_parser("run", help="submit, wait and collect")
+    run_parser.add_argument("pdf")
+    run_parser.add_argument("--output", help="also copy the Excel results here")
+    args = parser.parse_args()
+
+    if args.command in ("submit", "run"):
+        backend = analysis_batch.make_backend(args.backend, analysis.client)
+        job_dir = submit(args.pdf, backend)
+        if args.command == "submit":
+            return 0
+        return collect(job_dir, backend, True, args.output)
+
+    job = analysis_batch.load_job(args.job_dir)
+    backend = analysis_batch.make_backend(job["backend"], analysis.client)
+    if args.command == "status":
+        print(json.dumps(analysis_batch.job_status(backend, job)))
+        return 0
+    return collect(args.job_dir, backend, args.wait, args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
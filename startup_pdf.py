@@ -0,0 +1,132 @@
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# Page text is extracted by PDF_WORKERS processes (default: one per CPU), each
+# given one contiguous slice of the document (at least PAGES_PER_TASK pages),
+# so the PDF is opened once per worker. Short documents are read in process,
+# where starting a pool would cost more than it saves.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+PAGES_PER_TASK = 8
+MIN_PAGES_FOR_POOL = 16
+
+ACQUISITIONS_SECTION = "Recent and Selected Acquisitions/Exits of CMU spin-off companies"
+# Section and industry headings are whole lines, so they are looked up in sets
+# rather than matched with anchored alternations
+SECTIONS = frozenset([
+    ACQUISITIONS_SECTION,
+    "CMU spin-off companies backed by venture capital/ institutional investment",
+    "CMU early-stage spin-off companies without institutional investment",
+    "Pipeline: Emerging Spin-offs",
+])
+INDUSTRIES = frozenset([
+    "Cleantech/energy", "Electronics/Semiconductors", "Robotics", "Social Networking/Mobile Computing",
+    "Software and AI", "Medical Devices/Biotech", "Chemistry and Materials Science", "Social Ventures",
+])
+STARTUP_PATTERN = re.compile(r"^\d+\.\s+([A-Za-z0-9\s]+(?:, Inc\.| LLC)?(?:\s+\(Joint with .*\))?):")
+
+
+# "12. Name: ..." lines; only lines starting with a digit reach the regex
+def match_startup(line):
+    return STARTUP_PATTERN.match(line) if line[:1].isdecimal() else None
+
+
+# A section, industry or startup line, which ends the description being collected
+def is_boundary(line):
+    return line in SECTIONS or line in INDUSTRIES or match_startup(line) is not None
+
+
+# (page_num, text, error) for pages start..stop-1 (1-based) of the PDF. Runs
+# in worker processes, so it opens the file itself; only the pages of the
+# range are loaded.
+def extract_page_range(pdf_path, start, stop):
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(pdf_path, pages=range(start, stop)) as pdf:
+        for page in pdf.pages:
+            page_num = page.page_number
+            try:
+                pages.append((page_num, page.extract_text(), None))
+            except Exception as e:
+                pages.append((page_num, None, str(e)))
+            finally:
+                page.close()
+    return pages
+
+
+# Yield (page_num, text, error) for every page in order, extracting pages in
+# parallel while earlier ones are being parsed
+def iter_page_texts(pdf_path, workers=PDF_WORKERS):
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+    if workers <= 1 or page_count < MIN_PAGES_FOR_POOL:
+        yield from extract_page_range(pdf_path, 1, page_count + 1)
+        return
+    slice_size = max(PAGES_PER_TASK, math.ceil(page_count / workers))
+    starts = list(range(1, page_count + 1, slice_size))
+    stops = [min(start + slice_size, page_count + 1) for start in starts]
+    with ProcessPoolExecutor(max_workers=min(workers, len(starts))) as executor:
+        for pages in executor.map(extract_page_range, [pdf_path] * len(starts), starts, stops):
+            yield from pages
+
+
+# Single pass over the lines of each page. A startup line in `checklist` opens
+# a record; following lines are appended to its description until a section,
+# industry or startup line (tested unstripped) or the end of the page. Every
+# line is also checked, stripped, for a new section, industry or startup, so
+# records can overlap exactly as when each description was gathered by
+# rescanning ahead. Pages that failed to extract are passed to on_error.
+def parse_startup_pages(pages, checklist, on_error=None):
+    startups = []
+    current_section = ""
+    current_industry = ""
+    for page_num, text, error in pages:
+        if error is not None:
+            if on_error:
+                on_error(page_num, error)
+            continue
+        collecting = []  # (record, description parts) still taking lines
+        for raw_line in text.split("\n") if text else []:
+            line = raw_line.strip()
+            if collecting:
+                if is_boundary(raw_line):
+                    close_descriptions(collecting)
+                else:
+                    for _, parts in collecting:
+                        parts.append(line)
+
+            if line in SECTIONS:
+                current_section = line
+                current_industry = ""
+                continue
+
+            if current_section != ACQUISITIONS_SECTION and line in INDUSTRIES:
+                current_industry = line
+                continue
+
+            startup_match = match_startup(line)
+            if startup_match and current_section:
+                name = startup_match.group(1).strip()
+                if name not in checklist:
+                    continue
+                record = {
+                    "Company Name": name,
+                    "Description": "",
+                    "Section": current_section,
+                    "Industry Category": current_industry if current_industry else "N/A",
+                    "Website": ""  # No website data in PDF
+                }
+                startups.append(record)
+                collecting.append((record, [line[line.find(":") + 1:].strip()]))
+        close_descriptions(collecting)
+    return startups
+
+
+def close_descriptions(collecting):
+    for record, parts in collecting:
+        record["Description"] = " ".join(parts).strip()
+    collecting.clear()
@@ -0,0 +1,254 @@
+import io
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PILLARS = [
+    "Category Management",
+    "Product Development",
+    "Offline Promotion",
+    "Supply Chain/Logistics",
+    "Store Operations",
+]
+
+# Phrases that mark a question as being about a pillar. Only whole pillar
+# phrases count: a bare word such as "operations" or "promotion" also turns up
+# in questions about other pillars ("supply chain operations").
+PILLAR_KEYWORDS = {
+    "Category Management": ["category management"],
+    "Product Development": ["product development"],
+    "Offline Promotion": ["offline promotion", "in-store promotion"],
+    "Supply Chain/Logistics": ["supply chain", "logistics"],
+    "Store Operations": ["store operations", "store operation"],
+}
+
+# Columns sent with every retrieved row; pillar and detail columns are added
+# only when the question asks about them
+BASE_COLUMNS = ["Company", "Technology", "Summary", "Overall Score", "Category", "Industry"]
+DETAIL_COLUMNS = {
+    "Ability": ["ability", "abilities", "function", "capabilit"],
+    "Relevancy to Retail": ["relevan", "strategic fit", "why"],
+}
+# Text embedded for each startup row
+EMBEDDED_COLUMNS = ["Company", "Technology", "Ability", "Summary", "Relevancy to Retail", "Industry", "Category"]
+
+TOP_K_ROWS = int(os.getenv("TECH_DISRUPTOR_TOP_K", "15"))
+# Parquet copies of startup spreadsheets, one per source modification time
+STARTUP_CACHE_DIR = '.cache'
+
+
+def read_startup_excel(source):
+    return pd.read_excel(source, engine='openpyxl').dropna(how='all')
+
+
+# Load a startup spreadsheet from disk, parsing the xlsx only when it has
+# changed. The parsed rows are kept as Parquet keyed by the file's
+# modification time; without pyarrow the xlsx is parsed every time.
+def load_startup_data(path, cache_dir=STARTUP_CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}-{os.stat(path).st_mtime_ns}.parquet")
+    try:
+        df = pd.read_parquet(cache_path)
+    except (ImportError, OSError, ValueError):
+        df = read_startup_excel(path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(cache_path + '.tmp', index=False)
+            os.replace(cache_path + '.tmp', cache_path)
+            for name in os.listdir(cache_dir):
+                if name.startswith(f"{stem}-") and name.endswith('.parquet') and name != os.path.basename(cache_path):
+                    os.remove(os.path.join(cache_dir, name))
+        except Exception as e:
+            logger.warning("Could not write Parquet cache for %s: %s", path, e)
+    # Blank cells are filled after caching so column types survive in Parquet
+    return df.fillna('')
+
+
+def to_excel_bytes(df, sheet_name="Startup Analysis"):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+def mentioned_pillars(question):
+    text = question.lower()
+    return [pillar for pillar, keywords in PILLAR_KEYWORDS.items() if any(keyword in text for keyword in keywords)]
+
+
+def columns_for_question(question, available_columns):
+    text = question.lower()
+    columns = list(BASE_COLUMNS)
+    pillars = mentioned_pillars(question)
+    for column, keywords in DETAIL_COLUMNS.items():
+        if any(keyword in text for keyword in keywords):
+            columns.append(column)
+    if pillars:
+        for pillar in pillars:
+            columns += [f"{pillar} Score", f"{pillar} Reasoning"]
+    else:
+        # No pillar named: the scores let the model compare pillars without
+        # paying for every reasoning column
+        columns += [f"{pillar} Score" for pillar in PILLARS]
+    selected = [column for column in columns if column in available_columns]
+    # A spreadsheet with a different layout is sent as-is
+    return selected if selected else list(available_columns)
+
+
+def row_text(row, columns):
+    return "\n".join(f"{column}: {row[column]}" for column in columns if str(row[column]).strip())
+
+
+# Embeddings of every startup row, built once per spreadsheet version. Each
+# question retrieves only its top-k rows by cosine similarity, so the prompt
+# stays roughly the same size as the dataset grows.
+class StartupIndex:
+    def __init__(self, df, encode):
+        self.df = df.reset_index(drop=True)
+        columns = [column for column in EMBEDDED_COLUMNS if column in self.df.columns] or list(self.df.columns)
+        texts = [row_text(row, columns) for _, row in self.df.iterrows()]
+        embeddings = encode(texts) if texts else np.empty((0, 0), dtype='float32')
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True) if len(texts) else 1
+        self.embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+    def top_rows(self, query_embedding, k=TOP_K_ROWS):
+        if len(self.df) == 0:
+            return []
+        query = np.asarray(query_embedding, dtype='float32')
+        query = query / (np.linalg.norm(query) or 1)
+        scores = self.embeddings @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])].tolist()
+
+    # Only the retrieved rows and the columns the question needs, as CSV text
+    def context_for(self, question, query_embedding, k=TOP_K_ROWS):
+        rows = self.top_rows(query_embedding, k)
+        columns = columns_for_question(question, self.df.columns)
+        return self.df.loc[rows, columns].to_csv(index=False)
+
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+RANK_PATTERN = re.compile(r"\b(top|best|highest|leading|strongest|most promising|rank|ranking|ranked)\b")
+COUNT_PATTERN = re.compile(r"\b(?:top|best|highest|leading)\s+(\d+|" + "|".join(NUMBER_WORDS) + r")\b"
+                           r"|\b(\d+|" + "|".join(NUMBER_WORDS) + r")\s+(?:top|best|highest|leading|most)\b")
+LIST_PATTERN = re.compile(r"\b(list|show|which|what)\b")
+OVERALL_PATTERN = re.compile(r"\boverall\b")
+DEFAULT_RANK_COUNT = 5
+# Phrases in a Category (PDF section) value, and the question phrases that select it
+CATEGORY_KEYWORDS = [
+    ("venture capital", ["venture", "vc-backed", "vc backed", "investor-backed", "funded"]),
+    ("early-stage", ["early-stage", "early stage"]),
+    ("acquisitions", ["acquisition", "acquired", "exit"]),
+    ("pipeline", ["pipeline", "emerging"]),
+]
+
+
+def _value_pattern(value):
+    parts = [part.strip() for part in re.split(r"/| and |,", value.lower()) if len(part.strip()) >= 2]
+    return re.compile("|".join(r"\b" + re.escape(part) + r"\b" for part in parts)) if parts else None
+
+
+# Local query engine over the startup DataFrame. Sorted orderings for every
+# pillar score and the Overall Score are computed once, so ranking and
+# filtering questions are answered with a boolean mask over a precomputed
+# order instead of asking the LLM to rank the spreadsheet by eye.
+class StartupRanker:
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.score_columns = [column for column in [f"{pillar} Score" for pillar in PILLARS] + ["Overall Score"]
+                              if column in self.df.columns]
+        self.scores = {
+            column: pd.to_numeric(self.df[column], errors="coerce").fillna(0).to_numpy()
+            for column in self.score_columns
+        }
+        overall = self.scores.get("Overall Score", np.zeros(len(self.df)))
+        # Highest score first, ties broken by Overall Score
+        self.orders = {column: np.lexsort((-overall, -scores)) for column, scores in self.scores.items()}
+        self.filters = {}
+        for column in ("Industry", "Category"):
+            if column in self.df.columns:
+                values = self.df[column].astype(str)
+                self.filters[column] = {value: (values == value).to_numpy() for value in values.unique() if value.strip()}
+
+    def _matching_values(self, column, text):
+        matches = []
+        for value in self.filters.get(column, {}):
+            if column == "Category":
+                if any(marker in value.lower() and any(keyword in text for keyword in keywords)
+                       for marker, keywords in CATEGORY_KEYWORDS):
+                    matches.append(value)
+            else:
+                pattern = _value_pattern(value)
+                if pattern and pattern.search(text):
+                    matches.append(value)
+        return matches
+
+    # Recognise ranking and filter questions. A ranking must name what it
+    # ranks by or over (a pillar, industry, category or "overall"); "best at
+    # reducing food waste" is about a topic and, like anything else not
+    # recognised here, returns None and goes to the retrieval path.
+    def parse(self, question):
+        text = question.lower()
+        industries = self._matching_values("Industry", text)
+        categories = self._matching_values("Category", text)
+        pillars = [pillar for pillar in mentioned_pillars(question) if f"{pillar} Score" in self.scores]
+        wants_ranking = bool(RANK_PATTERN.search(text)) and bool(
+            pillars or industries or categories or OVERALL_PATTERN.search(text))
+        if not wants_ranking and not ((industries or categories) and LIST_PATTERN.search(text)):
+            return None
+        if not pillars and "Overall Score" not in self.scores:
+            return None
+        count = DEFAULT_RANK_COUNT
+        match = COUNT_PATTERN.search(text)
+        if match:
+            number = match.group(1) or match.group(2)
+            count = int(number) if number.isdigit() else NUMBER_WORDS[number]
+        elif not wants_ranking:
+            count = None  # a plain filter lists every match
+        return {"pillars": pillars, "count": count, "industries": industries, "categories": categories}
+
+    def run(self, intent):
+        pillars = intent["pillars"]
+        if len(pillars) == 1:
+            order = self.orders[f"{pillars[0]} Score"]
+        elif pillars:
+            combined = sum(self.scores[f"{pillar} Score"] for pillar in pillars)
+            order = np.lexsort((-self.scores.get("Overall Score", np.zeros(len(self.df))), -combined))
+        else:
+            order = self.orders["Overall Score"]
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, values in (("Industry", intent["industries"]), ("Category", intent["categories"])):
+            if values:
+                mask &= np.logical_or.reduce([self.filters[column][value] for value in values])
+        order = order[mask[order]]
+        if intent["count"] is not None:
+            order = order[:intent["count"]]
+        return self.df.iloc[order]
+
+    def columns_for(self, intent):
+        columns = list(BASE_COLUMNS)
+        for pillar in intent["pillars"] or PILLARS:
+            columns.append(f"{pillar} Score")
+        for pillar in intent["pillars"]:
+            columns.append(f"{pillar} Reasoning")
+        return [column for column in columns if column in self.df.columns]
+
+    def describe(self, intent):
+        ranking = " + ".join(f"{pillar} Score" for pillar in intent["pillars"]) or "Overall Score"
+        parts = [f"ranked by {ranking}"]
+        if intent["industries"]:
+            parts.append(f"industry: {', '.join(intent['industries'])}")
+        if intent["categories"]:
+            parts.append(f"category: {', '.join(intent['categories'])}")
+        if intent["count"] is not None:
+            parts.append(f"top {intent['count']}")
+        return "; ".join(parts)